@@ -0,0 +1,113 @@
+"""Compare PDF extraction backends on pages/sec.
+
+Generates a set of text PDFs (or uses the PDFs in ``--fixtures``) and times
+every available backend, in a single worker and across the process pool.
+
+    cd backend
+    python -m benchmarks.extractors --pages 4 32 128 --repeat 3
+"""
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.extractors import PdfExtractor, available_extractors
+
+WORDS = "retrieval augmented generation splits documents into chunks embeds them and searches for the closest ones".split()
+
+def _escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+def make_pdf(path: str, pages: int, lines_per_page: int = 45):
+    """Write a minimal uncompressed PDF with ``pages`` pages of Helvetica text."""
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # page tree, filled in once the page object numbers are known
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    page_refs = []
+    for page in range(pages):
+        lines = []
+        for line in range(lines_per_page):
+            words = [WORDS[(page * 7 + line * 3 + i) % len(WORDS)] for i in range(12)]
+            lines.append(f"({_escape(f'Page {page + 1} line {line + 1}: ' + ' '.join(words))}) Tj T*")
+        stream = ("BT /F1 10 Tf 12 TL 50 780 Td\n" + "\n".join(lines) + "\nET").encode('latin-1')
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % len(objects)
+        )
+        page_refs.append(b"%d 0 R" % len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [" + b" ".join(page_refs) + b"] /Count %d >>" % pages
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, 'wb') as f:
+        f.write(out)
+
+def run(fixtures, backends, workers, repeat):
+    results = []
+    for backend in backends:
+        extractor = PdfExtractor(backend=backend, workers=workers)
+        for path in fixtures:
+            for parallel in (False, True):
+                best, pages = None, []
+                for _ in range(repeat):
+                    started = time.perf_counter()
+                    pages = extractor.extract_pages(path, parallel=parallel)
+                    elapsed = time.perf_counter() - started
+                    best = elapsed if best is None else min(best, elapsed)
+                results.append({
+                    "backend": backend,
+                    "fixture": os.path.basename(path),
+                    "mode": f"parallel x{min(workers, len(pages) or 1)}" if parallel else "sequential",
+                    "pages": len(pages),
+                    "chars": sum(len(page) for page in pages),
+                    "seconds": round(best, 4),
+                    "pages_per_sec": round(len(pages) / best, 1) if best else None,
+                })
+        extractor.close()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, nargs="+", default=[4, 32, 128], help="page counts of the generated fixtures")
+    parser.add_argument("--fixtures", help="directory of PDFs to use instead of generated ones")
+    parser.add_argument("--backends", nargs="+", default=available_extractors("pdf"), help="backends to compare")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="process pool size for parallel runs")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per measurement; the fastest is reported")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        if args.fixtures:
+            fixtures = sorted(glob.glob(os.path.join(args.fixtures, "*.pdf")))
+        else:
+            fixtures = []
+            for pages in args.pages:
+                path = os.path.join(temp_dir, f"generated-{pages}p.pdf")
+                make_pdf(path, pages)
+                fixtures.append(path)
+        results = run(fixtures, args.backends, args.workers, args.repeat)
+
+    print(f"{'backend':<10} {'fixture':<24} {'mode':<14} {'pages':>6} {'seconds':>9} {'pages/sec':>10}")
+    for r in results:
+        print(f"{r['backend']:<10} {r['fixture']:<24} {r['mode']:<14} {r['pages']:>6} {r['seconds']:>9.3f} {r['pages_per_sec'] or 0:>10.1f}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,331 @@
+"""End-to-end load test of the API against the mock OpenRouter server.
+
+Starts the mock LLM server and the app as uvicorn subprocesses (fully
+offline: reranking off, fresh collection directory), seeds a few
+documents, then drives ``/chat``, ``/upload`` or a mix of both from
+``--concurrency`` closed-loop virtual users for ``--duration`` seconds.
+Reports p50/p95/p99 latency, throughput and error rates per endpoint and
+writes them as JSON together with the git commit and the test settings, so
+runs from different commits can be compared with ``--compare``.
+
+    cd backend
+    python -m benchmarks.loadtest --workload chat --concurrency 200 --duration 30
+    python -m benchmarks.loadtest --workload mixed --compare benchmarks/results/loadtest-<commit>-mixed.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import platform
+import tempfile
+import subprocess
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(BACKEND_DIR, "benchmarks", "results")
+
+TOPICS = ["vector search", "document chunking", "embedding models", "write-ahead logging", "query reranking", "conversation memory"]
+QUESTIONS = [
+    "What is {topic}?",
+    "How does {topic} work in this system?",
+    "What are the trade-offs of {topic}?",
+    "How does it scale?",
+    "Can you give an example?",
+]
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def git_info() -> Dict[str, Any]:
+    def git(*args) -> str:
+        return subprocess.run(["git", *args], cwd=BACKEND_DIR, capture_output=True, text=True).stdout.strip()
+    return {"git_commit": git("rev-parse", "HEAD") or None, "git_dirty": bool(git("status", "--porcelain"))}
+
+def make_document(index: int, size_kb: int) -> bytes:
+    rng = random.Random(index)
+    sentences = []
+    while sum(len(s) for s in sentences) < size_kb * 1024:
+        topic = rng.choice(TOPICS)
+        sentences.append(f"Section {len(sentences)} explains {topic} and how {rng.choice(TOPICS)} relates to it. ")
+    return "".join(sentences).encode('utf-8')
+
+def percentile(sorted_values: List[float], fraction: float) -> Optional[float]:
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(fraction * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+def summarize(records: List[Dict[str, Any]], seconds: float) -> Dict[str, Any]:
+    latencies = sorted(r["latency_ms"] for r in records)
+    errors = [r for r in records if r["error"]]
+    return {
+        "requests": len(records),
+        "errors": len(errors),
+        "error_rate": round(len(errors) / len(records), 4) if records else 0.0,
+        "throughput_rps": round(len(records) / seconds, 2) if seconds else 0.0,
+        "p50_ms": percentile(latencies, 0.50),
+        "p95_ms": percentile(latencies, 0.95),
+        "p99_ms": percentile(latencies, 0.99),
+        "mean_ms": round(sum(latencies) / len(latencies), 1) if latencies else None,
+        "max_ms": latencies[-1] if latencies else None,
+        "outcomes": dict(Counter(r["outcome"] for r in records)),
+    }
+
+class Servers:
+    """The mock LLM server and the app under test, as subprocesses."""
+
+    def __init__(self, args):
+        self.args = args
+        self.temp_dir = tempfile.TemporaryDirectory(prefix="loadtest-")
+        self.mock_url = f"http://127.0.0.1:{free_port()}"
+        self.app_url = f"http://127.0.0.1:{free_port()}"
+        self.processes: List[subprocess.Popen] = []
+
+    def _start(self, name: str, target: str, url: str, env: Dict[str, str]):
+        log = open(os.path.join(self.temp_dir.name, f"{name}.log"), 'w')
+        process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", target, "--port", url.rsplit(":", 1)[1], "--log-level", "warning"],
+            cwd=BACKEND_DIR, env={**os.environ, **env}, stdout=log, stderr=subprocess.STDOUT,
+        )
+        self.processes.append(process)
+
+    async def start(self):
+        mock_env = {
+            "MOCK_LATENCY_MS": str(self.args.latency_ms),
+            "MOCK_JITTER_MS": str(self.args.jitter_ms),
+            "MOCK_TOKENS": str(self.args.tokens),
+            "MOCK_RATE_429": str(self.args.rate_429),
+            "MOCK_RATE_TIMEOUT": str(self.args.rate_timeout),
+            "MOCK_MAX_CONCURRENCY": str(self.args.max_concurrency),
+            "MOCK_SEED": str(self.args.seed),
+        }
+        self._start("mock", "benchmarks.mock_openrouter:app", self.mock_url, mock_env)
+        self._start("app", "main:app", self.app_url, {
+            "OPENROUTER_BASE_URL": f"{self.mock_url}/api/v1",
+            "OPENROUTER_API_KEY": "loadtest",
+            "RERANK_ENABLED": "false",
+            "COLLECTIONS_DIR": os.path.join(self.temp_dir.name, "collections"),
+            "CONVERSATION_DIR": "",
+        })
+        await self._wait_ready(f"{self.mock_url}/stats")
+        await self._wait_ready(f"{self.app_url}/")
+
+    async def _wait_ready(self, url: str, timeout: float = 60.0):
+        deadline = time.monotonic() + timeout
+        async with httpx.AsyncClient() as client:
+            while time.monotonic() < deadline:
+                if any(p.poll() is not None for p in self.processes):
+                    break
+                try:
+                    if (await client.get(url)).status_code == 200:
+                        return
+                except httpx.HTTPError:
+                    pass
+                await asyncio.sleep(0.2)
+        self.dump_logs()
+        raise RuntimeError(f"Server at {url} did not become ready")
+
+    async def mock_stats(self) -> Optional[Dict[str, Any]]:
+        try:
+            async with httpx.AsyncClient() as client:
+                return (await client.get(f"{self.mock_url}/stats")).json()
+        except httpx.HTTPError:
+            return None
+
+    def dump_logs(self):
+        for name in ("mock", "app"):
+            path = os.path.join(self.temp_dir.name, f"{name}.log")
+            if os.path.exists(path):
+                with open(path, 'r') as f:
+                    print(f"--- {name} log ---\n{f.read()[-4000:]}", file=sys.stderr)
+
+    def stop(self):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        self.temp_dir.cleanup()
+
+class LoadTest:
+    def __init__(self, args, app_url: str):
+        self.args = args
+        self.app_url = app_url
+        self.records: List[Dict[str, Any]] = []
+        self.uploads = 0
+
+    async def _request(self, client: httpx.AsyncClient, op: str, send) -> Optional[httpx.Response]:
+        started = time.monotonic()
+        response, outcome = None, None
+        try:
+            response = await send()
+            outcome = str(response.status_code)
+        except httpx.TimeoutException:
+            outcome = "timeout"
+        except httpx.HTTPError as e:
+            outcome = type(e).__name__
+        self.records.append({
+            "op": op,
+            "started": started,
+            "latency_ms": round((time.monotonic() - started) * 1000, 1),
+            "outcome": outcome,
+            "error": response is None or response.status_code >= 400,
+        })
+        return response
+
+    async def upload(self, client: httpx.AsyncClient):
+        self.uploads += 1
+        index = self.uploads
+        files = {"files": (f"loadtest-{index}.txt", make_document(index, self.args.upload_kb), "text/plain")}
+        await self._request(client, "upload", lambda: client.post(f"{self.app_url}/upload", files=files))
+
+    async def user(self, client: httpx.AsyncClient, user_id: int, stop_at: float):
+        rng = random.Random(self.args.seed * 100003 + user_id)
+        conversation_id, turns = None, 0
+        while time.monotonic() < stop_at:
+            if self.args.workload == "upload" or (self.args.workload == "mixed" and rng.random() < self.args.upload_ratio):
+                await self.upload(client)
+                continue
+
+            # Each virtual user holds a conversation for a few turns, then starts over
+            if turns >= self.args.turns:
+                conversation_id, turns = None, 0
+            message = rng.choice(QUESTIONS).format(topic=rng.choice(TOPICS))
+            body = {"message": message, "conversation_id": conversation_id}
+            response = await self._request(client, "chat", lambda: client.post(f"{self.app_url}/chat", json=body))
+            if response is not None and response.status_code == 200:
+                conversation_id = response.json().get("conversation_id")
+            elif response is not None and response.status_code in (429, 503) and "retry-after" in response.headers:
+                # Back off as a well-behaved client would, rather than retry at once
+                await asyncio.sleep(min(float(response.headers["retry-after"]), stop_at - time.monotonic(), 10.0))
+            turns += 1
+
+    async def run(self) -> Dict[str, Any]:
+        limits = httpx.Limits(max_connections=self.args.concurrency, max_keepalive_connections=self.args.concurrency)
+        async with httpx.AsyncClient(limits=limits, timeout=self.args.request_timeout) as client:
+            for _ in range(self.args.seed_docs):
+                await self.upload(client)
+            self.records.clear()
+
+            started = time.monotonic()
+            stop_at = started + self.args.warmup + self.args.duration
+            await asyncio.gather(*(self.user(client, i, stop_at) for i in range(self.args.concurrency)))
+
+        # Requests started during warm-up are not measured
+        measured = [r for r in self.records if r["started"] >= started + self.args.warmup]
+        seconds = self.args.duration
+        results = {"all": summarize(measured, seconds)}
+        for op in sorted({r["op"] for r in measured}):
+            results[op] = summarize([r for r in measured if r["op"] == op], seconds)
+        return results
+
+def compare(baseline: Dict[str, Any], report: Dict[str, Any]):
+    print(f"\nCompared with {baseline['meta'].get('git_commit', '?')[:12]} ({baseline['meta'].get('timestamp')}):")
+    differing = {k: (v, report["config"].get(k)) for k, v in baseline["config"].items() if report["config"].get(k) != v and k not in ("output", "compare")}
+    if differing:
+        print(f"  warning: settings differ: {differing}")
+    print(f"  {'endpoint':<8} {'metric':<15} {'baseline':>10} {'current':>10} {'change':>9}")
+    for op, current in report["results"].items():
+        previous = baseline["results"].get(op)
+        if previous is None:
+            continue
+        for metric in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms", "error_rate"):
+            old, new = previous.get(metric), current.get(metric)
+            change = f"{(new - old) / old * 100:+.1f}%" if old and new is not None else "-"
+            print(f"  {op:<8} {metric:<15} {old if old is not None else '-':>10} {new if new is not None else '-':>10} {change:>9}")
+
+def print_report(report: Dict[str, Any]):
+    meta = report["meta"]
+    print(f"\nWorkload '{report['config']['workload']}', {report['config']['concurrency']} users, {report['config']['duration']}s at {(meta['git_commit'] or '?')[:12]}{' (dirty)' if meta['git_dirty'] else ''}")
+    print(f"  {'endpoint':<8} {'requests':>9} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>8}  outcomes")
+    for op, r in report["results"].items():
+        print(f"  {op:<8} {r['requests']:>9} {r['throughput_rps']:>8} {r['p50_ms'] or 0:>9} {r['p95_ms'] or 0:>9} {r['p99_ms'] or 0:>9} {r['error_rate']:>8.2%}  {r['outcomes']}")
+    if report.get("mock"):
+        mock = report["mock"]
+        print(f"  mock LLM: {mock['requests']} requests, {mock['rate_limited']} rate limited, {mock['timed_out']} hung")
+
+async def main_async(args):
+    servers = None
+    app_url = args.app_url
+    if app_url is None:
+        servers = Servers(args)
+        await servers.start()
+        app_url = servers.app_url
+    try:
+        results = await LoadTest(args, app_url).run()
+        mock = await servers.mock_stats() if servers else None
+    except Exception:
+        if servers:
+            servers.dump_logs()
+        raise
+    finally:
+        if servers:
+            servers.stop()
+
+    return {
+        "meta": {
+            **git_info(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        "results": results,
+        "mock": mock,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workload", choices=["chat", "upload", "mixed"], default="chat")
+    parser.add_argument("--concurrency", type=int, default=50, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=30, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=5, help="seconds run before measuring")
+    parser.add_argument("--upload-ratio", type=float, default=0.1, help="share of uploads in the mixed workload")
+    parser.add_argument("--upload-kb", type=int, default=20, help="size of each uploaded document")
+    parser.add_argument("--seed-docs", type=int, default=10, help="documents uploaded before the test")
+    parser.add_argument("--turns", type=int, default=5, help="chat turns per conversation")
+    parser.add_argument("--request-timeout", type=float, default=60, help="client timeout per request")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--app-url", help="test an already running app instead of starting one (and the mock)")
+    mock = parser.add_argument_group("mock LLM")
+    mock.add_argument("--latency-ms", type=float, default=300)
+    mock.add_argument("--jitter-ms", type=float, default=100)
+    mock.add_argument("--tokens", type=int, default=80)
+    mock.add_argument("--rate-429", type=float, default=0.0)
+    mock.add_argument("--rate-timeout", type=float, default=0.0)
+    mock.add_argument("--max-concurrency", type=int, default=0, help="429 beyond this many LLM calls in flight")
+    parser.add_argument("--output", help="report path (default: benchmarks/results/loadtest-<commit>-<workload>.json)")
+    parser.add_argument("--compare", help="earlier report to compare against")
+    args = parser.parse_args()
+
+    report = asyncio.run(main_async(args))
+    print_report(report)
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"loadtest-{(report['meta']['git_commit'] or 'unknown')[:12]}-{args.workload}.json")
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nReport written to {output}")
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            compare(json.load(f), report)
+
+if __name__ == "__main__":
+    main()
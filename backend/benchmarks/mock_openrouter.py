@@ -0,0 +1,161 @@
+"""Local stand-in for the OpenRouter chat-completions API, for offline load tests.
+
+Answers ``POST /api/v1/chat/completions`` like OpenRouter does, with or
+without SSE streaming, after a simulated latency. A configurable share of
+requests fails with 429 or hangs long enough to hit the caller's timeout,
+and with ``--max-concurrency`` every request beyond that many in flight
+gets a 429, like a provider's per-key concurrency limit.
+
+    cd backend
+    python -m benchmarks.mock_openrouter --port 9100 --latency-ms 300 --rate-429 0.02
+    OPENROUTER_BASE_URL=http://127.0.0.1:9100/api/v1 python main.py
+
+Every option can also be set through a ``MOCK_`` environment variable
+(``--latency-ms`` -> ``MOCK_LATENCY_MS``), which is how the load-test
+harness configures it.
+"""
+import os
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+from typing import Any, Dict
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+OPTIONS = {
+    # name: (type, default, help)
+    "latency_ms": (float, 300.0, "time to the first token"),
+    "jitter_ms": (float, 100.0, "uniform random extra time to the first token"),
+    "model_latency": (str, "", "per-model time to first token, e.g. 'a:free=800,b=150'"),
+    "tokens": (int, 80, "tokens per answer"),
+    "token_interval_ms": (float, 5.0, "time between streamed tokens"),
+    "rate_429": (float, 0.0, "share of requests answered with 429"),
+    "rate_timeout": (float, 0.0, "share of requests that hang"),
+    "max_concurrency": (int, 0, "answer 429 beyond this many requests in flight (0 for no limit)"),
+    "hang_seconds": (float, 60.0, "how long a hanging request hangs"),
+    "seed": (int, 0, "random seed (0 for unseeded)"),
+}
+
+WORDS = "the retrieved context describes how the system stores document chunks and answers questions about them".split()
+
+def load_config() -> Dict[str, Any]:
+    return {
+        name: kind(os.getenv(f"MOCK_{name.upper()}", default))
+        for name, (kind, default, _) in OPTIONS.items()
+    }
+
+config = load_config()
+rng = random.Random(config["seed"] or None)
+stats = {"requests": 0, "in_flight": 0, "streamed": 0, "rate_limited": 0, "timed_out": 0, "by_model": {}}
+
+app = FastAPI(title="Mock OpenRouter")
+
+def model_latency_ms(model: str) -> float:
+    for item in filter(None, config["model_latency"].split(",")):
+        name, _, value = item.rpartition("=")
+        if name == model:
+            return float(value)
+    return config["latency_ms"]
+
+def rate_limited() -> JSONResponse:
+    stats["rate_limited"] += 1
+    return JSONResponse(
+        status_code=429,
+        content={"error": {"code": 429, "message": "Rate limit exceeded (mock)"}},
+        headers={"Retry-After": "1"},
+    )
+
+def completion_chunk(completion_id: str, model: str, delta: Dict[str, Any], finish_reason=None) -> str:
+    return "data: " + json.dumps({
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }) + "\n\n"
+
+@app.get("/stats")
+async def get_stats():
+    return {"config": config, **stats}
+
+@app.post("/api/v1/chat/completions")
+async def chat_completions(request: Request):
+    payload = await request.json()
+    model = payload.get("model", "mock/model")
+    stats["requests"] += 1
+    stats["by_model"][model] = stats["by_model"].get(model, 0) + 1
+
+    roll = rng.random()
+    if roll < config["rate_429"]:
+        return rate_limited()
+    if config["max_concurrency"] and stats["in_flight"] >= config["max_concurrency"]:
+        return rate_limited()
+    # A request stays in flight until its last byte is sent
+    stats["in_flight"] += 1
+    streamed = False
+    try:
+        if roll < config["rate_429"] + config["rate_timeout"]:
+            stats["timed_out"] += 1
+            await asyncio.sleep(config["hang_seconds"])
+        response = await respond(payload, model)
+        streamed = isinstance(response, StreamingResponse)
+        return response
+    finally:
+        if not streamed:
+            stats["in_flight"] -= 1
+
+async def respond(payload: Dict[str, Any], model: str):
+    first_token = (model_latency_ms(model) + rng.uniform(0, config["jitter_ms"])) / 1000.0
+    interval = config["token_interval_ms"] / 1000.0
+    tokens = [WORDS[i % len(WORDS)] + " " for i in range(config["tokens"])]
+    completion_id = f"gen-{uuid.uuid4().hex[:16]}"
+
+    if payload.get("stream"):
+        stats["streamed"] += 1
+
+        async def events():
+            try:
+                await asyncio.sleep(first_token)
+                yield completion_chunk(completion_id, model, {"role": "assistant", "content": ""})
+                for token in tokens:
+                    yield completion_chunk(completion_id, model, {"content": token})
+                    await asyncio.sleep(interval)
+                yield completion_chunk(completion_id, model, {}, finish_reason="stop")
+                yield "data: [DONE]\n\n"
+            finally:
+                stats["in_flight"] -= 1
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    await asyncio.sleep(first_token + interval * len(tokens))
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": "".join(tokens).strip()},
+            "finish_reason": "stop",
+        }],
+        "usage": {"prompt_tokens": 0, "completion_tokens": len(tokens), "total_tokens": len(tokens)},
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    for name, (kind, _, help_text) in OPTIONS.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=kind, default=config[name], help=help_text)
+    args = parser.parse_args()
+    config.update({name: getattr(args, name) for name in OPTIONS})
+    rng.seed(config["seed"] or None)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
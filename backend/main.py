@@ -1,14 +1,23 @@
 import os
-from typing import List, Optional
-from fastapi import FastAPI, File, UploadFile, HTTPException
+import json
+import math
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, List, Optional, Tuple
+from fastapi import FastAPI, File, UploadFile, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 import uvicorn
 from dotenv import load_dotenv
 
 from services.document_processor import DocumentProcessor
 from services.simple_vector_store import SimpleVectorStore
-from services.llm_service import LLMService
+from services.llm_service import LLMService, LLMError, LLMUnavailableError, LLMTimeoutError
+from services.collection_manager import CollectionManager, DEFAULT_COLLECTION
+from services.document_catalog import decode_cursor
+from services.conversation_store import ConversationStore
+from services.reranker import Reranker
+from services.admission_controller import AdmissionController, AdmissionRejected
 from models.chat import ChatRequest, ChatResponse, Source
 
 load_dotenv()
@@ -26,8 +35,11 @@ app.add_middleware(
 
 # Services will be initialized lazily
 document_processor = None
-vector_store = None
+collection_manager = None
 llm_service = None
+conversation_store = None
+reranker = None
+admission_controller = None
 
 def get_document_processor():
     global document_processor
@@ -35,11 +47,25 @@ def get_document_processor():
         document_processor = DocumentProcessor()
     return document_processor
 
-def get_vector_store():
-    global vector_store
-    if vector_store is None:
-        vector_store = SimpleVectorStore()
-    return vector_store
+def get_collection_manager():
+    global collection_manager
+    if collection_manager is None:
+        collection_manager = CollectionManager(store_factory=SimpleVectorStore)
+    return collection_manager
+
+def use_vector_store(collection: str = DEFAULT_COLLECTION, create: bool = False):
+    """Lease the vector store of a collection for the duration of a request.
+
+    A collection that does not exist is a 404 unless ``create`` is set, so
+    read-only requests cannot create collections on disk.
+    """
+    try:
+        CollectionManager.validate_name(collection)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not create and not get_collection_manager().exists(collection):
+        raise HTTPException(status_code=404, detail=f"Collection '{collection}' not found")
+    return get_collection_manager().lease(collection, create)
 
 def get_llm_service():
     global llm_service
@@ -47,163 +73,281 @@ def get_llm_service():
         llm_service = LLMService()
     return llm_service
 
+def get_conversation_store():
+    global conversation_store
+    if conversation_store is None:
+        conversation_store = ConversationStore()
+    return conversation_store
+
+def get_reranker():
+    global reranker
+    if reranker is None:
+        reranker = Reranker()
+    return reranker
+
+def get_admission_controller():
+    global admission_controller
+    if admission_controller is None:
+        # Rate limits and deadline misses from the LLM mean too much concurrency
+        admission_controller = AdmissionController(overload_errors=(LLMUnavailableError, LLMTimeoutError))
+    return admission_controller
+
+def client_id(http_request: Request) -> str:
+    """Key for fair queueing: an explicit X-Client-Id header, else the client address."""
+    return http_request.headers.get("x-client-id") or (http_request.client.host if http_request.client else "")
+
+PageFetcher = Callable[[Any, Optional[str], int], Awaitable[Tuple[List[Any], Optional[str]]]]
+
+def stream_pages(key: str, collection: str, fetch_page: PageFetcher, cursor: Optional[str], page_size: int = 500) -> StreamingResponse:
+    """Stream every item from ``cursor`` onwards as one JSON object, page by page.
+    
+    The body is sent after the handler returns, so the collection is leased
+    by the generator itself and stays loaded until the last page is out.
+    """
+    lease = use_vector_store(collection)
+    decode_cursor(cursor)  # Reject a bad cursor with a 400 before streaming starts
+    
+    async def generate() -> AsyncIterator[str]:
+        next_cursor = cursor
+        separator = ""
+        async with lease as vs:
+            yield f'{{"{key}": ['
+            while True:
+                items, next_cursor = await fetch_page(vs, next_cursor, page_size)
+                for item in items:
+                    yield separator + json.dumps(item)
+                    separator = ","
+                if next_cursor is None:
+                    break
+            yield "]}"
+    
+    return StreamingResponse(generate(), media_type="application/json")
+
+def chunk_info(chunk) -> dict:
+    return {
+        "id": chunk.id,
+        "document_id": chunk.document_id,
+        "content": chunk.content[:200] + "..." if len(chunk.content) > 200 else chunk.content,
+        "metadata": chunk.metadata
+    }
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Flush pending write-ahead log records of all loaded collections and stop worker pools."""
+    if collection_manager is not None:
+        await collection_manager.close()
+    if llm_service is not None:
+        await llm_service.close()
+    if document_processor is not None:
+        document_processor.close()
+
 @app.get("/")
 async def root():
     return {"message": "GenAI RAG Chatbot API"}
 
+@app.get("/metrics")
+async def metrics():
+    """Load and latency metrics of the request path, as JSON."""
+    return {
+        "admission": get_admission_controller().stats(),
+        "llm": llm_service.stats() if llm_service is not None else None,
+        "reranker": reranker.stats() if reranker is not None else None,
+        "collections": collection_manager.stats() if collection_manager is not None else None,
+    }
+
+@app.get("/collections")
+async def list_collections():
+    """List known collections and whether they are currently loaded."""
+    manager = get_collection_manager()
+    return {"collections": manager.list_collections(), "stats": manager.stats()}
+
 @app.post("/upload")
-async def upload_documents(files: List[UploadFile] = File(...)):
-    """Upload and process documents for the knowledge base."""
+async def upload_documents(
+    files: List[UploadFile] = File(...),
+    collection: str = Query(DEFAULT_COLLECTION),
+):
+    """Upload and process documents for the knowledge base, creating the collection if needed."""
     try:
-        processed_docs = []
-        for file in files:
-            if not file.filename:
-                continue
+        async with use_vector_store(collection, create=True) as vs:
+            processed_docs = []
+            for file in files:
+                if not file.filename:
+                    continue
+                    
+                # Save uploaded file temporarily
+                temp_path = f"/tmp/{file.filename}"
+                with open(temp_path, "wb") as buffer:
+                    content = await file.read()
+                    buffer.write(content)
+                
+                # Process document
+                chunks = await get_document_processor().process_document(temp_path)
+                
+                # Add to vector store
+                doc_id = await vs.add_document(file.filename, chunks)
+                processed_docs.append({
+                    "filename": file.filename,
+                    "document_id": doc_id,
+                    "chunks_count": len(chunks),
+                    # Near-duplicates of stored chunks, which were not embedded or indexed again
+                    "duplicate_chunks": vs.get_document(doc_id).get("duplicate_chunks", 0)
+                })
                 
-            # Save uploaded file temporarily
-            temp_path = f"/tmp/{file.filename}"
-            with open(temp_path, "wb") as buffer:
-                content = await file.read()
-                buffer.write(content)
-            
-            # Process document
-            chunks = await get_document_processor().process_document(temp_path)
-            
-            # Add to vector store
-            doc_id = await get_vector_store().add_document(file.filename, chunks)
-            processed_docs.append({
-                "filename": file.filename,
-                "document_id": doc_id,
-                "chunks_count": len(chunks)
-            })
-            
-            # Clean up temp file
-            os.remove(temp_path)
+                # Clean up temp file
+                os.remove(temp_path)
         
         return {"message": "Documents processed successfully", "documents": processed_docs}
     
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
+async def chat(request: ChatRequest, http_request: Request, collection: str = Query(DEFAULT_COLLECTION)):
     """Process a chat request and return a response with sources."""
+    received = time.monotonic()
     try:
-        # Retrieve relevant documents
-        relevant_docs = await get_vector_store().search(request.message, k=5)
+        try:
+            conversation = get_conversation_store().get_or_create(request.conversation_id)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
         
-        # Convert DocumentChunk objects to Source objects for LLM service
-        sources = []
-        for doc in relevant_docs:
-            source = Source(
-                document_name=doc.metadata.get("source", "Unknown"),
-                chunk_text=doc.content,
-                score=1.0  # Simple vector store doesn't provide scores
-            )
-            sources.append(source)
+        # Retrieval and generation run only once admitted, so shedding a
+        # request under overload costs next to nothing
+        async with get_admission_controller().admit(client_id(http_request)) as admission:
+            # Retrieve a wide candidate set using a query that stands on its own,
+            # then keep only the best few chunks for the LLM prompt
+            search_query = get_conversation_store().condense_query(conversation, request.message)
+            async with use_vector_store(collection) as vs:
+                candidates = await vs.search(search_query, k=get_reranker().candidate_k)
+            relevant_docs = await get_reranker().rerank(search_query, candidates)
         
-        # Generate response using LLM
-        response = await get_llm_service().generate_response(
-            question=request.message,
-            context_docs=sources
-        )
+            # Convert DocumentChunk objects to Source objects for LLM service
+            sources = []
+            for doc, score in relevant_docs:
+                source = Source(
+                    document_name=doc.metadata.get("source", "Unknown"),
+                    chunk_text=doc.content,
+                    score=score,  # None if reranking was skipped or ran out of budget
+                    duplicate_sources=doc.metadata.get("duplicate_sources", [])
+                )
+                sources.append(source)
+        
+            # Generate response using LLM; time spent queueing for admission
+            # counts against the request's deadline
+            llm = get_llm_service()
+            response = await llm.generate_response(
+                question=request.message,
+                context_docs=sources,
+                history=get_conversation_store().history_messages(conversation),
+                deadline=received + llm.deadline_seconds,
+                on_first_token=admission.responding
+            )
+        get_conversation_store().add_exchange(conversation, request.message, response["answer"])
         
         return ChatResponse(
             response=response["answer"],
-            sources=response["sources"]
+            sources=response["sources"],
+            conversation_id=conversation.id,
+            model=response.get("model")
         )
     
+    except HTTPException:
+        raise
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(int(e.retry_after))})
+    except LLMError as e:
+        # 502 bad upstream response, 503 models unavailable, 504 deadline exceeded
+        headers = None
+        if isinstance(e, LLMUnavailableError) and e.retry_after:
+            headers = {"Retry-After": str(int(math.ceil(e.retry_after)))}
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers=headers)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/documents")
-async def list_documents():
-    """List all documents in the knowledge base."""
+async def list_documents(
+    collection: str = Query(DEFAULT_COLLECTION),
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    stream: bool = False,
+):
+    """List documents in the knowledge base, one page at a time.
+
+    Pass the returned ``next_cursor`` to fetch the following page. With
+    ``stream=true`` every document from ``cursor`` onwards is streamed instead.
+    """
     try:
-        documents = await get_vector_store().list_documents()
-        return {"documents": documents}
+        if stream:
+            return stream_pages("documents", collection, lambda vs, page_cursor, page_limit: vs.list_documents(page_cursor, page_limit), cursor)
+        async with use_vector_store(collection) as vs:
+            documents, next_cursor = await vs.list_documents(cursor, limit)
+        return {"documents": documents, "next_cursor": next_cursor}
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/debug/chunks")
-async def debug_chunks():
-    """Debug endpoint to see all stored chunks."""
+async def debug_chunks(
+    collection: str = Query(DEFAULT_COLLECTION),
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    stream: bool = False,
+):
+    """Debug endpoint to page through stored chunks."""
+    async def fetch_page(vs, page_cursor: Optional[str], page_limit: int):
+        chunks, next_cursor = await vs.list_chunks(page_cursor, page_limit)
+        return [chunk_info(chunk) for chunk in chunks], next_cursor
+    
     try:
-        vs = get_vector_store()
-        chunks_info = []
-        for chunk_id, chunk in vs.documents.items():
-            chunks_info.append({
-                "id": chunk.id,
-                "document_id": chunk.document_id,
-                "content": chunk.content[:200] + "..." if len(chunk.content) > 200 else chunk.content,
-                "metadata": chunk.metadata
-            })
-        return {"chunks": chunks_info}
+        if stream:
+            return stream_pages("chunks", collection, fetch_page, cursor)
+        async with use_vector_store(collection) as vs:
+            chunks_info, next_cursor = await fetch_page(vs, cursor, limit)
+        return {"chunks": chunks_info, "next_cursor": next_cursor}
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.delete("/documents/{doc_id}")
-async def delete_document(doc_id: str):
+async def delete_document(doc_id: str, collection: str = Query(DEFAULT_COLLECTION)):
     """Delete a document from the knowledge base."""
     try:
-        success = await get_vector_store().delete_document(doc_id)
+        async with use_vector_store(collection) as vs:
+            success = await vs.delete_document(doc_id)
         if success:
             return {"message": "Document deleted successfully"}
         else:
             raise HTTPException(status_code=404, detail="Document not found")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/test-search")
-async def test_search(query: str = "RAG"):
+async def test_search(query: str = "RAG", collection: str = Query(DEFAULT_COLLECTION)):
     """Test endpoint to debug search functionality."""
     try:
-        vs = get_vector_store()
         print(f"Testing search for: {query}")
-        results = await vs.search(query, k=3)
+        async with use_vector_store(collection) as vs:
+            results = await vs.search(query, k=3)
         print(f"Search returned {len(results)} results")
         
-        search_results = []
-        for result in results:
-            search_results.append({
-                "id": result.id,
-                "content": result.content[:200] + "..." if len(result.content) > 200 else result.content,
-                "metadata": result.metadata
-            })
+        search_results = [chunk_info(result) for result in results]
         
         return {"query": query, "results": search_results}
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Search error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/debug/chunks")
-async def debug_chunks():
-    """Debug endpoint to see all stored chunks."""
-    try:
-        vs = get_vector_store()
-        chunks_info = []
-        for chunk_id, chunk in vs.documents.items():
-            chunks_info.append({
-                "id": chunk.id,
-                "document_id": chunk.document_id,
-                "content": chunk.content[:200] + "..." if len(chunk.content) > 200 else chunk.content,
-                "metadata": chunk.metadata
-            })
-        return {"chunks": chunks_info}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-
-@app.delete("/documents/{doc_id}")
-async def delete_document(doc_id: str):
-    """Delete a document from the knowledge base."""
-    try:
-        success = await get_vector_store().delete_document(doc_id)
-        if success:
-            return {"message": "Document deleted successfully"}
-        else:
-            raise HTTPException(status_code=404, detail="Document not found")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8001)
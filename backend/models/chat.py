@@ -8,15 +8,27 @@ class ChatRequest(BaseModel):
 class Source(BaseModel):
     document_name: str
     chunk_text: str
-    score: float
+    score: Optional[float] = None  # cross-encoder score; None if the chunk was not reranked
+    duplicate_sources: List[str] = []  # other documents containing a near-duplicate of this chunk
 
 class ChatResponse(BaseModel):
     response: str
     sources: List[Source]
     conversation_id: Optional[str] = None
+    model: Optional[str] = None
 
 class DocumentChunk(BaseModel):
     id: str
     document_id: str
     content: str
     metadata: dict
+
+class ConversationTurn(BaseModel):
+    role: str
+    content: str
+
+class Conversation(BaseModel):
+    id: str
+    turns: List[ConversationTurn] = []
+    summary_lines: List[str] = []
+    updated_at: float = 0.0
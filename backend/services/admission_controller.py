@@ -0,0 +1,296 @@
+import os
+import math
+import time
+import random
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, Optional, Tuple, Type
+
+logger = logging.getLogger(__name__)
+
+class AdmissionRejected(Exception):
+    """The request was shed; ``retry_after`` is a hint in seconds for the client."""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"Server overloaded ({reason}), retry in {retry_after:.0f}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+def _percentile(values, fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+class _WindowedMedian:
+    """Lowest median of the coarse time buckets covering the last ``window`` seconds.
+
+    A bucket's median is robust to the spread of individual values, and
+    taking the lowest bucket keeps the baseline from drifting up with a slow
+    rise in load. Each bucket keeps a uniform random sample of at most
+    ``bucket_samples`` of its values, so memory stays bounded however busy
+    the server is.
+    """
+
+    def __init__(self, window: float, buckets: int = 5, bucket_samples: int = 200):
+        self.window = window
+        self.bucket_width = window / buckets
+        self.bucket_samples = bucket_samples
+        self._buckets: Deque[list] = deque()  # [bucket start, sampled values, count]
+        self._random = random.Random()
+
+    def add(self, value: float, now: float):
+        start = now - now % self.bucket_width
+        if not self._buckets or self._buckets[-1][0] != start:
+            self._buckets.append([start, [], 0])
+        bucket = self._buckets[-1]
+        bucket[2] += 1
+        if len(bucket[1]) < self.bucket_samples:
+            bucket[1].append(value)
+        else:
+            # Reservoir sampling: every value of the bucket is equally likely to be kept
+            slot = self._random.randrange(bucket[2])
+            if slot < self.bucket_samples:
+                bucket[1][slot] = value
+        self._expire(now)
+
+    def value(self, now: float, min_samples: int = 1) -> Optional[float]:
+        """None until some bucket has ``min_samples`` values; sparser buckets are too noisy to count."""
+        self._expire(now)
+        medians = [_percentile(bucket[1], 0.5) for bucket in self._buckets if bucket[2] >= min_samples]
+        return min(medians) if medians else None
+
+    def _expire(self, now: float):
+        while self._buckets and self._buckets[0][0] + self.bucket_width <= now - self.window:
+            self._buckets.popleft()
+
+class Admission:
+    """A slot held by one request; ``waited`` is the time it spent queueing."""
+
+    def __init__(self, waited: float):
+        self.waited = waited
+        self.started = time.monotonic()
+        self.first_response: Optional[float] = None
+
+    def responding(self):
+        """Mark the moment the response starts, e.g. the LLM's first token."""
+        if self.first_response is None:
+            self.first_response = time.monotonic() - self.started
+
+class AdmissionController:
+    """Bounds concurrent work behind an adaptive limit with a fair, bounded queue.
+
+    Requests beyond the limit wait in one FIFO queue per client, and freed
+    slots go to the clients in round-robin order, so a single busy client
+    cannot starve the others. A request is shed immediately when the queue
+    is full or its expected wait exceeds ``max_wait``, and after waiting
+    ``max_wait`` without a slot.
+
+    The limit follows AIMD: it grows by about one per limit's worth of
+    successful requests while it is fully used (by one per request, i.e.
+    doubling, until the first decrease or until the recent time to first
+    response is a quarter above the baseline), and is multiplied by
+    ``backoff`` (at most once per typical request duration) when a request
+    fails with one of ``overload_errors`` or the time to first response
+    stays high: the median of the last ``recent_samples`` requests must
+    exceed ``latency_tolerance`` times the baseline for ``recent_samples``
+    requests in a row. The baseline is the lowest median of the time
+    buckets covering the last ``baseline_window`` seconds. Medians rather
+    than a minimum and a single moving average keep the natural spread of
+    LLM latencies from reading as overload. Time to first
+    response (admission to the LLM's first token, reported through
+    ``Admission.responding``) grows with queueing upstream but not with the
+    length of the answer, which dominates the total request time.
+    """
+
+    def __init__(
+        self,
+        initial_limit: Optional[int] = None,
+        min_limit: Optional[int] = None,
+        max_limit: Optional[int] = None,
+        max_queue: Optional[int] = None,
+        max_wait_ms: Optional[float] = None,
+        latency_tolerance: Optional[float] = None,
+        baseline_window: Optional[float] = None,
+        backoff: float = 0.75,
+        recent_samples: int = 50,
+        overload_errors: Tuple[Type[BaseException], ...] = (),
+    ):
+        self.min_limit = min_limit or int(os.getenv("ADMISSION_MIN_LIMIT", "2"))
+        self.max_limit = max_limit or int(os.getenv("ADMISSION_MAX_LIMIT", "128"))
+        self.limit = float(initial_limit or int(os.getenv("ADMISSION_INITIAL_LIMIT", "16")))
+        self.max_queue = max_queue or int(os.getenv("ADMISSION_MAX_QUEUE", "256"))
+        self.max_wait = (max_wait_ms or float(os.getenv("ADMISSION_MAX_WAIT_MS", "5000"))) / 1000.0
+        self.latency_tolerance = latency_tolerance or float(os.getenv("ADMISSION_LATENCY_TOLERANCE", "2.0"))
+        self.baseline_window = baseline_window or float(os.getenv("ADMISSION_BASELINE_WINDOW_S", "300"))
+        self.backoff = backoff
+        self.overload_errors = overload_errors
+
+        self.in_flight = 0
+        self.queued = 0
+        self._queues: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()
+        # Whole time a slot is held, for wait estimates; time to first response, for overload
+        self.latency_ewma: Optional[float] = None
+        self.first_response_ewma: Optional[float] = None
+        self._first_response_baseline = _WindowedMedian(self.baseline_window)
+        self._recent_first_responses: deque = deque(maxlen=recent_samples)
+        # Consecutive requests that found the recent median above the tolerance
+        self._slow_streak = 0
+        self._waits: deque = deque(maxlen=1000)
+        self._last_decrease = 0.0
+        self._slow_start = True
+
+        self.admitted = 0
+        self.rejected: Dict[str, int] = {}
+        self.overloaded = 0
+
+    def _expected_wait(self, position: int) -> float:
+        # Slots free up at roughly limit / latency per second
+        return position * (self.latency_ewma or 0.0) / max(1, int(self.limit))
+
+    def _reject(self, reason: str, expected_wait: float) -> AdmissionRejected:
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        return AdmissionRejected(reason, max(1.0, math.ceil(expected_wait)))
+
+    @asynccontextmanager
+    async def admit(self, client_id: str = "") -> AsyncIterator[Admission]:
+        """Hold a slot for the duration of the block; yields the ``Admission``.
+
+        Raises ``AdmissionRejected`` if no slot can be had in time.
+        """
+        enqueued = time.monotonic()
+        if self.in_flight < int(self.limit) and not self.queued:
+            self.in_flight += 1
+        else:
+            await self._wait_for_slot(client_id)
+        waited = time.monotonic() - enqueued
+        self._waits.append(waited)
+        self.admitted += 1
+
+        admission = Admission(waited)
+        overloaded = False
+        try:
+            yield admission
+        except self.overload_errors:
+            overloaded = True
+            raise
+        finally:
+            self._release(time.monotonic() - admission.started, overloaded, admission.first_response)
+
+    async def _wait_for_slot(self, client_id: str):
+        expected_wait = self._expected_wait(self.queued + 1)
+        if self.queued >= self.max_queue:
+            raise self._reject("queue_full", expected_wait)
+        if expected_wait > self.max_wait:
+            # Shed now rather than let the request time out in the queue
+            raise self._reject("expected_wait", expected_wait)
+
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(client_id, deque()).append(future)
+        self.queued += 1
+        try:
+            await asyncio.wait({future}, timeout=self.max_wait)
+        except asyncio.CancelledError:
+            if future.done():
+                # Granted just as the caller went away; hand the slot on
+                self._release(None, False, None)
+            else:
+                self._dequeue(client_id, future)
+            raise
+        if not future.done():
+            self._dequeue(client_id, future)
+            raise self._reject("queue_timeout", self._expected_wait(self.queued + 1))
+
+    def _dequeue(self, client_id: str, future: asyncio.Future):
+        queue = self._queues.get(client_id)
+        if queue is not None and future in queue:
+            queue.remove(future)
+            self.queued -= 1
+            if not queue:
+                del self._queues[client_id]
+        future.cancel()
+
+    def _grant_next(self):
+        while self.in_flight < int(self.limit) and self._queues:
+            # Serve clients in turn: take the head of the first queue, rotate it to the back
+            client_id, queue = next(iter(self._queues.items()))
+            future = queue.popleft()
+            self.queued -= 1
+            if queue:
+                self._queues.move_to_end(client_id)
+            else:
+                del self._queues[client_id]
+            self.in_flight += 1
+            future.set_result(None)
+
+    def _release(self, latency: Optional[float], overloaded: bool, first_response: Optional[float]):
+        saturated = self.in_flight >= int(self.limit)
+        self.in_flight -= 1
+        now = time.monotonic()
+        if overloaded:
+            self.overloaded += 1
+            self._decrease(now, "errors")
+        elif latency is not None:
+            self.latency_ewma = latency if self.latency_ewma is None else 0.8 * self.latency_ewma + 0.2 * latency
+            if first_response is not None:
+                self._first_response_baseline.add(first_response, now)
+                self._recent_first_responses.append(first_response)
+                self.first_response_ewma = first_response if self.first_response_ewma is None else 0.8 * self.first_response_ewma + 0.2 * first_response
+                baseline = self.baseline_latency(now)
+                recent = self.recent_latency()
+                slow = baseline is not None and recent is not None and recent > baseline * self.latency_tolerance
+                self._slow_streak = self._slow_streak + 1 if slow else 0
+                if self._slow_start and baseline is not None and recent is not None and recent > baseline * 1.25:
+                    # As in TCP's HyStart: stop doubling once latency starts
+                    # to rise, before the overshoot skews the baseline
+                    self._slow_start = False
+            if self._slow_streak >= self._recent_first_responses.maxlen:
+                self._slow_streak = 0
+                self._decrease(now, "latency")
+            elif saturated and not self._slow_streak:
+                step = 1.0 if self._slow_start else 1.0 / self.limit
+                self.limit = min(self.max_limit, self.limit + step)
+        self._grant_next()
+
+    def _decrease(self, now: float, cause: str):
+        # One cut per typical request duration, so a burst of failures from
+        # the same overload does not collapse the limit
+        if now - self._last_decrease < (self.latency_ewma or 0.0):
+            return
+        self._last_decrease = now
+        self._slow_start = False
+        previous = self.limit
+        self.limit = max(self.min_limit, self.limit * self.backoff)
+        if int(previous) != int(self.limit):
+            logger.info(f"Admission limit {int(previous)} -> {int(self.limit)} ({cause})")
+
+    def baseline_latency(self, now: Optional[float] = None) -> Optional[float]:
+        """Time to first response when not overloaded: the lowest bucket median over the baseline window."""
+        return self._first_response_baseline.value(time.monotonic() if now is None else now, min_samples=20)
+
+    def recent_latency(self) -> Optional[float]:
+        """Median time to first response of the last ``recent_samples`` requests, once there are that many."""
+        recent = self._recent_first_responses
+        return _percentile(recent, 0.5) if len(recent) == recent.maxlen else None
+
+    def stats(self) -> dict:
+        waits = list(self._waits)
+        to_ms = lambda seconds: round(seconds * 1000, 1) if seconds is not None else None
+        return {
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "queue_depth": self.queued,
+            "queued_clients": len(self._queues),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "overloaded": self.overloaded,
+            "wait_ms_p50": to_ms(_percentile(waits, 0.5)),
+            "wait_ms_p95": to_ms(_percentile(waits, 0.95)),
+            "wait_ms_p99": to_ms(_percentile(waits, 0.99)),
+            "latency_ms_ewma": to_ms(self.latency_ewma),
+            "first_response_ms_ewma": to_ms(self.first_response_ewma),
+            "recent_first_response_ms": to_ms(self.recent_latency()),
+            "baseline_first_response_ms": to_ms(self.baseline_latency()),
+        }
@@ -0,0 +1,402 @@
+import io
+import re
+import json
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from models.chat import DocumentChunk
+
+# Per-chunk NumPy columns and their dtypes
+COLUMNS = {
+    "ids": np.int64,          # chunk id, increasing in insertion order
+    "doc_idx": np.int32,      # index into the document id/source lists
+    "text_offset": np.int64,  # byte offset of the chunk text in the text buffer
+    "text_length": np.int32,  # byte length of the chunk text
+    "chunk_index": np.int32,
+    "start_pos": np.int64,
+    "end_pos": np.int64,
+    "alive": np.bool_,
+    "canonical_id": np.int64, # chunk holding the vector, the chunk's own id unless a near-duplicate
+    "folded_offset": np.int64, # byte offset of the lowercased chunk text in the folded buffer, -1 if not needed
+    "folded_length": np.int32,
+}
+# Columns rebuilt from the text on load rather than persisted
+DERIVED_COLUMNS = {"folded_offset", "folded_length"}
+# Written after every chunk's text, so a keyword hit can never span two chunks
+SEPARATOR = b"\0"
+# Bytes of the text buffer lowercased at a time during keyword search
+FOLD_WINDOW = 1 << 20
+
+def _find(buffer: bytearray, encoded: bytes, fold_case: bool) -> np.ndarray:
+    """Start positions of ``encoded`` in ``buffer``, optionally ignoring ASCII case.
+
+    Case is folded one window at a time, so a search never holds a lowercased
+    copy of the whole buffer, and the scan itself uses a plain literal pattern.
+    """
+    pattern = re.compile(re.escape(encoded))
+    if not fold_case:
+        return np.fromiter((m.start() for m in pattern.finditer(buffer)), dtype=np.int64)
+    positions: List[int] = []
+    for start in range(0, len(buffer), FOLD_WINDOW):
+        # Overlap the next window so that hits crossing the boundary are found
+        window = buffer[start:start + FOLD_WINDOW + len(encoded) - 1].lower()
+        for match in pattern.finditer(window):
+            if match.start() >= FOLD_WINDOW:
+                break
+            positions.append(start + match.start())
+    return np.array(positions, dtype=np.int64)
+
+class ChunkTable:
+    """Columnar chunk storage: NumPy columns plus one contiguous UTF-8 text buffer.
+
+    Chunks get integer IDs in insertion order, so rows are always sorted by ID
+    and a document's chunks occupy a contiguous run of rows. Deleting marks
+    rows dead; once dead rows outnumber live ones the table is vacuumed.
+    Each chunk keeps the ID of its canonical chunk: itself, or the chunk
+    it is a near-duplicate of. The canonical chunk stands in for all of its
+    duplicates in search.
+    Keyword search folds ASCII case at query time; only chunks that
+    ``str.lower`` changes beyond ASCII keep a lowercased copy, in a
+    second, usually small, buffer.
+    ``DocumentChunk`` objects are only built on request, for the rows being
+    returned to a caller.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        self._columns = {name: np.zeros(capacity, dtype=dtype) for name, dtype in COLUMNS.items()}
+        self._rows = 0
+        self._alive_rows = 0
+        self._text = bytearray()
+        self._folded_text = bytearray()
+        self._doc_ids: List[str] = []
+        self._doc_sources: List[str] = []
+        self._doc_index: Dict[str, int] = {}
+        self.next_id = 1
+
+    def __len__(self) -> int:
+        return self._alive_rows
+
+    def column(self, name: str) -> np.ndarray:
+        """View of a column over the used rows (live and dead)."""
+        return self._columns[name][:self._rows]
+
+    def _reserve(self, extra: int):
+        needed = self._rows + extra
+        capacity = len(self._columns["ids"])
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        for name, values in self._columns.items():
+            grown = np.zeros(capacity, dtype=values.dtype)
+            grown[:self._rows] = values[:self._rows]
+            self._columns[name] = grown
+
+    def first_id_for(self, first_id: Optional[int] = None) -> int:
+        """ID the next appended document's first chunk will get."""
+        return self.next_id if first_id is None else max(first_id, self.next_id)
+
+    def append_document(
+        self,
+        doc_id: str,
+        source: str,
+        chunks: List[DocumentChunk],
+        first_id: Optional[int] = None,
+        canonical_ids: Optional[np.ndarray] = None,
+    ) -> Tuple[int, int]:
+        """Append a document's chunks; returns the first and last chunk ID given.
+
+        Without ``canonical_ids`` every chunk is its own canonical.
+        """
+        if doc_id not in self._doc_index:
+            self._doc_index[doc_id] = len(self._doc_ids)
+            self._doc_ids.append(doc_id)
+            self._doc_sources.append(source)
+        doc_idx = self._doc_index[doc_id]
+
+        first_id = self.first_id_for(first_id)
+        self._reserve(len(chunks))
+        start, end = self._rows, self._rows + len(chunks)
+        columns = self._columns
+        for row, chunk in enumerate(chunks, start=start):
+            encoded = chunk.content.encode('utf-8')
+            columns["text_offset"][row] = len(self._text)
+            columns["text_length"][row] = len(encoded)
+            self._text += encoded
+            self._text += SEPARATOR
+            self._fold(row, encoded, chunk.content)
+            columns["chunk_index"][row] = chunk.metadata.get("chunk_index", row - start)
+            columns["start_pos"][row] = chunk.metadata.get("start_pos", 0)
+            columns["end_pos"][row] = chunk.metadata.get("end_pos", 0)
+        columns["ids"][start:end] = np.arange(first_id, first_id + len(chunks))
+        columns["doc_idx"][start:end] = doc_idx
+        columns["alive"][start:end] = True
+        columns["canonical_id"][start:end] = columns["ids"][start:end] if canonical_ids is None else canonical_ids
+
+        self._rows = end
+        self._alive_rows += len(chunks)
+        self.next_id = first_id + len(chunks)
+        return first_id, first_id + len(chunks) - 1
+
+    def delete_range(self, first_id: int, last_id: int) -> int:
+        """Mark the chunks with ``first_id <= id <= last_id`` as deleted."""
+        ids = self.column("ids")
+        lo, hi = np.searchsorted(ids, [first_id, last_id + 1])
+        alive = self.column("alive")
+        removed = int(alive[lo:hi].sum())
+        alive[lo:hi] = False
+        self._alive_rows -= removed
+        if self._rows - self._alive_rows > max(self._alive_rows, 1024):
+            self.vacuum()
+        return removed
+
+    def promote_duplicates(self, first_id: int, last_id: int) -> List[Tuple[int, int]]:
+        """Re-point duplicates of canonical chunks in an ID range about to be deleted.
+
+        For every canonical chunk in the range with live duplicates outside
+        it, the lowest-ID such duplicate becomes the new canonical of the
+        group. Returns (old, new) canonical ID pairs.
+        """
+        ids = self.column("ids")
+        canonical = self.column("canonical_id")
+        alive = self.column("alive")
+        lo, hi = np.searchsorted(ids, [first_id, last_id + 1])
+        outside = alive.copy()
+        outside[lo:hi] = False
+        dependents = np.flatnonzero(outside & (canonical >= first_id) & (canonical <= last_id))
+        if not len(dependents):
+            return []
+        # Rows are in ID order, so each group's first occurrence is its lowest ID
+        groups, first = np.unique(canonical[dependents], return_index=True)
+        promoted = ids[dependents[first]]
+        canonical[dependents] = promoted[np.searchsorted(groups, canonical[dependents])]
+        return list(zip(groups.tolist(), promoted.tolist()))
+
+    def canonical_ids_in_range(self, first_id: int, last_id: int) -> np.ndarray:
+        """IDs of the live canonical chunks with ``first_id <= id <= last_id``."""
+        ids = self.column("ids")
+        lo, hi = np.searchsorted(ids, [first_id, last_id + 1])
+        keep = self.column("alive")[lo:hi] & (self.column("canonical_id")[lo:hi] == ids[lo:hi])
+        return ids[lo:hi][keep]
+
+    def canonical_ids(self) -> np.ndarray:
+        """IDs of all live canonical chunks."""
+        ids = self.column("ids")
+        return ids[self.column("alive") & (self.column("canonical_id") == ids)]
+
+    def texts(self, chunk_ids: Iterable[int]) -> Iterator[str]:
+        """Texts of the given live chunks, in order."""
+        for row in self.rows_for_ids(np.asarray(list(chunk_ids), dtype=np.int64)).tolist():
+            yield self.text(row)
+
+    def duplicate_count(self) -> int:
+        """Number of live chunks that are near-duplicates of another chunk."""
+        return int((self.column("alive") & (self.column("canonical_id") != self.column("ids"))).sum())
+
+    def duplicate_sources(self, canonical_ids: Iterable[int]) -> Dict[int, List[str]]:
+        """For each canonical chunk ID, the other documents' sources with a duplicate of it."""
+        canonical_ids = np.asarray(list(canonical_ids), dtype=np.int64)
+        ids = self.column("ids")
+        canonical = self.column("canonical_id")
+        rows = np.flatnonzero(self.column("alive") & (canonical != ids) & np.isin(canonical, canonical_ids))
+        canonical_rows = self.rows_for_ids(canonical[rows])
+        doc_idx = self.column("doc_idx")
+        sources: Dict[int, List[str]] = {}
+        for row, canonical_row in zip(rows.tolist(), canonical_rows.tolist()):
+            names = sources.setdefault(int(canonical[row]), [])
+            source = self._doc_sources[doc_idx[row]]
+            if source not in names and source != self._doc_sources[doc_idx[canonical_row]]:
+                names.append(source)
+        return sources
+
+    def vacuum(self):
+        """Drop dead rows and their text, keeping IDs and order."""
+        keep = np.flatnonzero(self.column("alive"))
+        offsets = self.column("text_offset")[keep]
+        lengths = self.column("text_length")[keep]
+
+        text = bytearray()
+        for offset, length in zip(offsets.tolist(), lengths.tolist()):
+            text += self._text[offset:offset + length]
+            text += SEPARATOR
+
+        # Renumber the documents that still have live chunks
+        old_doc_idx = self.column("doc_idx")[keep]
+        live_docs, new_doc_idx = np.unique(old_doc_idx, return_inverse=True)
+        self._doc_ids = [self._doc_ids[i] for i in live_docs.tolist()]
+        self._doc_sources = [self._doc_sources[i] for i in live_docs.tolist()]
+        self._doc_index = {doc_id: i for i, doc_id in enumerate(self._doc_ids)}
+
+        columns = {name: self.column(name)[keep].copy() for name in COLUMNS}
+        columns["doc_idx"] = new_doc_idx.astype(np.int32)
+        columns["text_offset"] = np.concatenate(([0], np.cumsum(lengths + 1)[:-1])).astype(np.int64) if len(keep) else np.zeros(0, np.int64)
+        self._load_columns(columns, text)
+
+    def _load_columns(self, columns: Dict[str, np.ndarray], text: bytearray):
+        rows = len(columns["ids"])
+        capacity = max(1024, rows)
+        self._columns = {}
+        for name, dtype in COLUMNS.items():
+            values = np.zeros(capacity, dtype=dtype)
+            if name not in DERIVED_COLUMNS:
+                values[:rows] = columns[name]
+            self._columns[name] = values
+        self._rows = rows
+        self._alive_rows = int(columns["alive"].sum())
+        offsets = self._columns["text_offset"][:rows]
+        lengths = self._columns["text_length"][:rows]
+        if rows and len(text) == int(lengths.sum()):
+            # Text written before chunks were separated: add the separators
+            separated = bytearray()
+            for offset, length in zip(offsets.tolist(), lengths.tolist()):
+                separated += text[offset:offset + length]
+                separated += SEPARATOR
+            text = separated
+            offsets[:] = np.concatenate(([0], np.cumsum(lengths + 1)[:-1]))
+        self._text = text
+        # Only chunks with non-ASCII bytes can need a folded copy, so only those are decoded
+        self._folded_text = bytearray()
+        self._columns["folded_offset"][:] = -1
+        non_ascii = np.flatnonzero(np.frombuffer(text, dtype=np.uint8) >= 0x80)
+        for row in np.unique(np.searchsorted(offsets, non_ascii, side='right') - 1).tolist():
+            offset, length = int(offsets[row]), int(lengths[row])
+            encoded = bytes(text[offset:offset + length])
+            self._fold(row, encoded, encoded.decode('utf-8'))
+
+    def _fold(self, row: int, encoded: bytes, content: str):
+        """Keep a lowercased copy of a chunk if ASCII case folding does not match ``str.lower``."""
+        self._columns["folded_offset"][row] = -1
+        if encoded.isascii():
+            return
+        lowered = content.lower().encode('utf-8')
+        if lowered == encoded.lower():
+            return
+        self._columns["folded_offset"][row] = len(self._folded_text)
+        self._columns["folded_length"][row] = len(lowered)
+        self._folded_text += lowered
+        self._folded_text += SEPARATOR
+
+    def rows_for_ids(self, ids: np.ndarray) -> np.ndarray:
+        """Rows of the given chunk IDs, or -1 for IDs that are unknown or deleted."""
+        ids = np.asarray(ids, dtype=np.int64)
+        all_ids = self.column("ids")
+        rows = np.searchsorted(all_ids, ids)
+        found = rows < self._rows
+        found[found] = (all_ids[rows[found]] == ids[found]) & self.column("alive")[rows[found]]
+        return np.where(found, rows, -1)
+
+    def text(self, row: int) -> str:
+        offset = int(self._columns["text_offset"][row])
+        return self._text[offset:offset + int(self._columns["text_length"][row])].decode('utf-8')
+
+    def doc_id(self, row: int) -> str:
+        return self._doc_ids[self._columns["doc_idx"][row]]
+
+    def chunk(self, row: int) -> DocumentChunk:
+        """Materialize one row as a ``DocumentChunk``."""
+        columns = self._columns
+        metadata = {
+            "source": self._doc_sources[columns["doc_idx"][row]],
+            "chunk_index": int(columns["chunk_index"][row]),
+            "start_pos": int(columns["start_pos"][row]),
+            "end_pos": int(columns["end_pos"][row]),
+        }
+        if columns["canonical_id"][row] != columns["ids"][row]:
+            metadata["duplicate_of"] = str(int(columns["canonical_id"][row]))
+        return DocumentChunk(
+            id=str(int(columns["ids"][row])),
+            document_id=self.doc_id(row),
+            content=self.text(row),
+            metadata=metadata
+        )
+
+    def chunks(self, rows: Iterator[int]) -> List[DocumentChunk]:
+        return [self.chunk(int(row)) for row in rows]
+
+    def page(self, after_id: int, limit: int) -> Tuple[List[int], Optional[int]]:
+        """Live rows with an ID greater than ``after_id``, at most ``limit``.
+
+        Returns the rows and the ID to resume from, or None on the last page.
+        Dead rows are skipped window by window, so the cost stays proportional
+        to the page size rather than to the table size.
+        """
+        start = int(np.searchsorted(self.column("ids"), after_id, side='right'))
+        alive = self.column("alive")
+        rows: List[int] = []
+        window = max(limit, 64)
+        while start < self._rows and len(rows) < limit:
+            rows.extend((np.flatnonzero(alive[start:start + window]) + start)[:limit - len(rows)].tolist())
+            start += window
+            window *= 2
+        next_id = int(self._columns["ids"][rows[-1]]) if len(rows) == limit else None
+        return rows, next_id
+
+    def match_counts(self, words: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """For each live canonical row containing any of ``words``, the number of words it contains.
+
+        Each word is found with one scan over the text buffer, folding ASCII
+        case a window at a time, plus one over the folded buffer for chunks whose case
+        ``str.lower`` folds beyond ASCII, and the hits are mapped to rows by
+        binary search on the offsets rather than by testing every chunk
+        separately. Matching ignores case the way ``str.lower`` does.
+        """
+        folded_offsets = self.column("folded_offset")
+        folded = folded_offsets >= 0
+        folded_rows = np.flatnonzero(folded)
+        # Near-duplicates are represented by their canonical chunk
+        alive = self.column("alive") & (self.column("canonical_id") == self.column("ids"))
+        counts = np.zeros(self._rows, dtype=np.int32)
+        for word in words:
+            encoded = word.lower().encode('utf-8')
+            if not encoded or SEPARATOR in encoded:
+                continue
+            # ASCII case folding matches str.lower for every chunk without a folded copy
+            positions = _find(self._text, encoded, fold_case=True)
+            rows = np.searchsorted(self.column("text_offset"), positions, side='right') - 1
+            rows = rows[~folded[rows]]
+            if folded_rows.size:
+                positions = _find(self._folded_text, encoded, fold_case=False)
+                rows = np.concatenate((rows, folded_rows[np.searchsorted(folded_offsets[folded_rows], positions, side='right') - 1]))
+            counts[np.unique(rows[alive[rows]])] += 1
+        matched = np.flatnonzero(counts)
+        return matched, counts[matched]
+
+    def iter_doc_ids(self) -> Iterator[Tuple[int, str]]:
+        """(chunk ID, document ID) of every live row, in order."""
+        for row in np.flatnonzero(self.column("alive")).tolist():
+            yield int(self._columns["ids"][row]), self.doc_id(row)
+
+    def memory_usage(self) -> int:
+        column_bytes = sum(values.nbytes for values in self._columns.values())
+        doc_bytes = sum(len(doc_id) + len(source) + 100 for doc_id, source in zip(self._doc_ids, self._doc_sources))
+        return column_bytes + len(self._text) + len(self._folded_text) + doc_bytes
+
+    def snapshot(self) -> Tuple[bytes, bytes]:
+        """Serialize to (columns, text) byte strings, e.g. for an atomic write."""
+        buffer = io.BytesIO()
+        np.savez(
+            buffer,
+            **{name: self.column(name) for name in COLUMNS if name not in DERIVED_COLUMNS},
+            meta=np.frombuffer(json.dumps({
+                "doc_ids": self._doc_ids,
+                "doc_sources": self._doc_sources,
+                "next_id": self.next_id,
+            }).encode('utf-8'), dtype=np.uint8)
+        )
+        return buffer.getvalue(), bytes(self._text)
+
+    @classmethod
+    def from_snapshot(cls, columns_data: bytes, text: bytes) -> "ChunkTable":
+        table = cls()
+        with np.load(io.BytesIO(columns_data)) as data:
+            meta = json.loads(data["meta"].tobytes().decode('utf-8'))
+            columns = {name: data[name] for name in COLUMNS if name in data.files and name not in DERIVED_COLUMNS}
+        # Snapshots from before near-duplicate detection: every chunk is canonical
+        columns.setdefault("canonical_id", columns["ids"])
+        table._load_columns(columns, bytearray(text))
+        table._doc_ids = meta["doc_ids"]
+        table._doc_sources = meta["doc_sources"]
+        table._doc_index = {doc_id: i for i, doc_id in enumerate(table._doc_ids)}
+        table.next_id = meta["next_id"]
+        return table
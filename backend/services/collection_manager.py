@@ -0,0 +1,192 @@
+import os
+import re
+import asyncio
+import logging
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_COLLECTION = "default"
+
+# Collection names double as directory names, so keep them filesystem-safe.
+COLLECTION_NAME_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_-]{0,63}$")
+
+class CollectionNotFoundError(LookupError):
+    """The collection does not exist and the caller did not ask to create it."""
+
+class CollectionManager:
+    """Loads named collections lazily and evicts idle ones under a memory budget.
+
+    Every collection keeps its own index and chunk store in a subdirectory of
+    ``base_dir``. Loaded stores are kept in LRU order; when the combined
+    ``memory_usage()`` of all loaded stores exceeds the budget, the least
+    recently used unpinned collections are dropped from memory. They are
+    reloaded from disk on their next access. Only callers that pass
+    ``create=True`` (uploads) bring a new collection into existence; the
+    default collection always exists. Collections leased by an
+    in-flight request are never evicted, so a request cannot keep writing to
+    a store instance that has already been replaced by a fresh load.
+    """
+
+    def __init__(
+        self,
+        store_factory: Callable[[str], Any],
+        base_dir: Optional[str] = None,
+        memory_budget_bytes: Optional[int] = None,
+        pinned: Optional[Iterable[str]] = None,
+    ):
+        self.store_factory = store_factory
+        self.base_dir = base_dir or os.getenv("COLLECTIONS_DIR", "./collections")
+        if memory_budget_bytes is None:
+            memory_budget_bytes = int(float(os.getenv("COLLECTION_MEMORY_BUDGET_MB", "512")) * 1024 * 1024)
+        self.memory_budget_bytes = memory_budget_bytes
+        if pinned is None:
+            pinned = [name.strip() for name in os.getenv("PINNED_COLLECTIONS", DEFAULT_COLLECTION).split(",") if name.strip()]
+        self._pinned: Set[str] = set(pinned)
+        self._stores: "OrderedDict[str, Any]" = OrderedDict()
+        self._load_locks: Dict[str, asyncio.Lock] = {}
+        self._leases: Dict[str, int] = {}
+        # Evicted stores still flushing their write-ahead log
+        self._closing: Dict[str, asyncio.Task] = {}
+        self.loads = 0
+        self.evictions = 0
+
+    @staticmethod
+    def validate_name(name: str) -> str:
+        """Return ``name`` if it is a valid collection name, else raise ValueError."""
+        if not COLLECTION_NAME_PATTERN.match(name or ""):
+            raise ValueError(
+                f"Invalid collection name '{name}': use 1-64 letters, digits, '-' or '_'"
+            )
+        return name
+
+    def collection_dir(self, name: str) -> str:
+        return os.path.join(self.base_dir, self.validate_name(name))
+
+    def exists(self, name: str) -> bool:
+        return name == DEFAULT_COLLECTION or name in self._stores or os.path.isdir(self.collection_dir(name))
+
+    async def get(self, name: str = DEFAULT_COLLECTION, create: bool = False) -> Any:
+        """Return the store for ``name``, loading it from disk on first access.
+
+        Raises ``CollectionNotFoundError`` for a collection that does not
+        exist yet, unless ``create`` is set.
+        """
+        self.validate_name(name)
+
+        store = self._stores.get(name)
+        if store is not None:
+            self._stores.move_to_end(name)
+            return store
+
+        # Concurrent first accesses to the same collection share a single load
+        lock = self._load_locks.setdefault(name, asyncio.Lock())
+        async with lock:
+            store = self._stores.get(name)
+            if store is None:
+                # A just-evicted instance must finish writing before it is reloaded
+                closing = self._closing.get(name)
+                if closing is not None:
+                    await closing
+                if not create and not self.exists(name):
+                    raise CollectionNotFoundError(f"Collection '{name}' not found")
+                logger.info(f"Loading collection '{name}'")
+                store = await asyncio.to_thread(self.store_factory, self.collection_dir(name))
+                self._stores[name] = store
+                self.loads += 1
+            self._stores.move_to_end(name)
+
+        self._enforce_budget(keep=name)
+        return store
+
+    @asynccontextmanager
+    async def lease(self, name: str = DEFAULT_COLLECTION, create: bool = False):
+        """Use a collection's store, keeping it resident until the block exits."""
+        self.validate_name(name)
+        self._leases[name] = self._leases.get(name, 0) + 1
+        try:
+            yield await self.get(name, create)
+        finally:
+            self._leases[name] -= 1
+            if not self._leases[name]:
+                del self._leases[name]
+            # The request may have grown the store, so re-check the budget
+            self._enforce_budget(keep=name)
+
+    def pin(self, name: str):
+        """Keep ``name`` resident regardless of memory pressure."""
+        self._pinned.add(self.validate_name(name))
+
+    def unpin(self, name: str):
+        self._pinned.discard(name)
+
+    def evict(self, name: str) -> bool:
+        """Drop a loaded collection from memory. Its data stays on disk."""
+        store = self._stores.pop(name, None)
+        if store is None:
+            return False
+        self.evictions += 1
+        logger.info(f"Evicted collection '{name}' ({store.memory_usage()} bytes)")
+        
+        task = asyncio.create_task(store.close())
+        self._closing[name] = task
+        task.add_done_callback(lambda done: self._forget_closed(name, done))
+        return True
+
+    def _forget_closed(self, name: str, task: asyncio.Task):
+        if self._closing.get(name) is task:
+            del self._closing[name]
+
+    async def close(self):
+        """Flush every loaded collection, e.g. on shutdown."""
+        for name in list(self._stores.keys()):
+            self.evict(name)
+        if self._closing:
+            await asyncio.gather(*self._closing.values())
+
+    def memory_usage(self) -> int:
+        return sum(store.memory_usage() for store in self._stores.values())
+
+    def _enforce_budget(self, keep: Optional[str] = None):
+        """Evict least recently used, unpinned collections until under budget."""
+        total = self.memory_usage()
+        for name in list(self._stores.keys()):
+            if total <= self.memory_budget_bytes:
+                break
+            if name == keep or name in self._pinned or name in self._leases:
+                continue
+            total -= self._stores[name].memory_usage()
+            self.evict(name)
+
+    def list_collections(self) -> List[Dict[str, Any]]:
+        """List collections on disk and in memory with their residency state."""
+        names = set(self._stores.keys())
+        if os.path.isdir(self.base_dir):
+            names.update(
+                entry for entry in os.listdir(self.base_dir)
+                if COLLECTION_NAME_PATTERN.match(entry) and os.path.isdir(os.path.join(self.base_dir, entry))
+            )
+
+        collections = []
+        for name in sorted(names):
+            store = self._stores.get(name)
+            collections.append({
+                "name": name,
+                "loaded": store is not None,
+                "pinned": name in self._pinned,
+                "memory_bytes": store.memory_usage() if store is not None else 0,
+            })
+        return collections
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "loaded": list(self._stores.keys()),
+            "memory_bytes": self.memory_usage(),
+            "memory_budget_bytes": self.memory_budget_bytes,
+            "pinned": sorted(self._pinned),
+            "loads": self.loads,
+            "evictions": self.evictions,
+            "stores": {name: store.stats() for name, store in self._stores.items()},
+        }
@@ -0,0 +1,244 @@
+import os
+import re
+import json
+import time
+import uuid
+import logging
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from models.chat import Conversation, ConversationTurn
+
+logger = logging.getLogger(__name__)
+
+# Conversation IDs are used as file names when persistence is enabled.
+CONVERSATION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+# Words that make a question depend on earlier turns ("what about *it*?").
+FOLLOW_UP_WORDS = {'it', 'its', 'this', 'that', 'these', 'those', 'they', 'them', 'their', 'he', 'she', 'his', 'her', 'one', 'ones', 'above', 'previous', 'same', 'more', 'else', 'also'}
+
+STOP_WORDS = {'what', 'is', 'how', 'are', 'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'by', 'does', 'do', 'can', 'will', 'would', 'should', 'could', 'about', 'tell', 'me', 'you', 'please', 'why', 'when', 'where', 'which', 'who', 'was', 'were', 'be', 'explain', 'describe'}
+
+SUMMARY_HEADER = "Summary of the earlier conversation:\n"
+
+# Seconds between scans of the persist directory for expired conversations
+SWEEP_INTERVAL_SECONDS = 60
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token for English text)."""
+    return (len(text) + 3) // 4
+
+def _truncate(text: str, max_chars: int) -> str:
+    text = " ".join(text.split())
+    return text if len(text) <= max_chars else text[:max_chars - 3].rstrip() + "..."
+
+class ConversationStore:
+    """Keeps chat history server-side with a fixed token bound per conversation.
+
+    The most recent turns are kept verbatim. Older turns are folded into a
+    running summary of one short line per turn, and the oldest summary lines
+    are dropped once the summary outgrows its share of the budget. The history
+    handed to the LLM therefore never exceeds ``max_history_tokens``, however
+    long the conversation runs.
+
+    Conversations live in an in-memory LRU with a TTL and are optionally
+    persisted as one JSON file per conversation under ``persist_dir``.
+    Files of conversations that are not in memory expire by modification
+    time; the directory is swept on startup and then at most once a minute.
+    """
+
+    def __init__(
+        self,
+        persist_dir: Optional[str] = None,
+        ttl_seconds: Optional[float] = None,
+        max_conversations: Optional[int] = None,
+        recent_turns: Optional[int] = None,
+        max_history_tokens: Optional[int] = None,
+    ):
+        self.persist_dir = persist_dir if persist_dir is not None else os.getenv("CONVERSATION_DIR", "")
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else float(os.getenv("CONVERSATION_TTL_SECONDS", "3600"))
+        self.max_conversations = max_conversations or int(os.getenv("MAX_CONVERSATIONS", "1000"))
+        self.recent_turns = recent_turns or int(os.getenv("CONVERSATION_RECENT_TURNS", "6"))
+        self.max_history_tokens = max_history_tokens or int(os.getenv("CONVERSATION_HISTORY_TOKENS", "1500"))
+        # A third of the budget goes to the summary, the rest to verbatim turns
+        self.summary_token_budget = self.max_history_tokens // 3 - estimate_tokens(SUMMARY_HEADER)
+        self.turn_token_budget = self.max_history_tokens - self.summary_token_budget
+        self._conversations: "OrderedDict[str, Conversation]" = OrderedDict()
+        self._last_sweep = 0.0
+
+        if self.persist_dir:
+            os.makedirs(self.persist_dir, exist_ok=True)
+            self._sweep_files()
+
+    def _path(self, conversation_id: str) -> str:
+        return os.path.join(self.persist_dir, f"{conversation_id}.json")
+
+    def _is_expired(self, conversation: Conversation) -> bool:
+        return self.ttl_seconds > 0 and time.time() - conversation.updated_at > self.ttl_seconds
+
+    def _load(self, conversation_id: str) -> Optional[Conversation]:
+        if not self.persist_dir or not os.path.exists(self._path(conversation_id)):
+            return None
+        try:
+            with open(self._path(conversation_id), 'r') as f:
+                return Conversation(**json.load(f))
+        except Exception as e:
+            logger.error(f"Failed to load conversation {conversation_id}: {e}")
+            return None
+
+    def _save(self, conversation: Conversation):
+        if not self.persist_dir:
+            return
+        path = self._path(conversation.id)
+        temp_path = f"{path}.tmp"
+        try:
+            with open(temp_path, 'w') as f:
+                json.dump(conversation.model_dump(), f)
+            os.replace(temp_path, path)
+        except Exception as e:
+            logger.error(f"Failed to save conversation {conversation.id}: {e}")
+
+    def _remove(self, conversation_id: str):
+        self._conversations.pop(conversation_id, None)
+        if self.persist_dir and os.path.exists(self._path(conversation_id)):
+            os.remove(self._path(conversation_id))
+
+    def get_or_create(self, conversation_id: Optional[str] = None) -> Conversation:
+        """Return the live conversation for ``conversation_id`` or start a new one."""
+        if conversation_id is None:
+            conversation_id = str(uuid.uuid4())
+        elif not CONVERSATION_ID_PATTERN.match(conversation_id):
+            raise ValueError(f"Invalid conversation_id '{conversation_id}'")
+
+        conversation = self._conversations.get(conversation_id) or self._load(conversation_id)
+        if conversation is not None and self._is_expired(conversation):
+            self._remove(conversation_id)
+            conversation = None
+        if conversation is None:
+            conversation = Conversation(id=conversation_id)
+
+        # Idle time counts from the last access, which keeps the LRU ordered by it
+        conversation.updated_at = time.time()
+        self._conversations[conversation_id] = conversation
+        self._conversations.move_to_end(conversation_id)
+        self._evict()
+        return conversation
+
+    def _evict(self):
+        """Drop expired conversations and trim the in-memory LRU to its size limit."""
+        for conversation_id, conversation in list(self._conversations.items()):
+            if not self._is_expired(conversation):
+                # Entries are in LRU order, so everything after this is fresher
+                break
+            self._remove(conversation_id)
+
+        while len(self._conversations) > self.max_conversations:
+            # Persisted conversations can still be reloaded from disk later
+            self._conversations.popitem(last=False)
+
+        if self.persist_dir and time.time() - self._last_sweep > SWEEP_INTERVAL_SECONDS:
+            self._sweep_files()
+
+    def _sweep_files(self):
+        """Delete persisted conversations that are not in memory and idle beyond the TTL."""
+        self._last_sweep = time.time()
+        if self.ttl_seconds <= 0:
+            return
+        cutoff = self._last_sweep - self.ttl_seconds
+        removed = 0
+        for entry in os.listdir(self.persist_dir):
+            conversation_id, extension = os.path.splitext(entry)
+            if extension != ".json" or conversation_id in self._conversations:
+                continue
+            path = os.path.join(self.persist_dir, entry)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    removed += 1
+            except OSError as e:
+                logger.warning(f"Failed to expire conversation file {entry}: {e}")
+        if removed:
+            logger.info(f"Expired {removed} persisted conversations")
+
+    def add_exchange(self, conversation: Conversation, question: str, answer: str):
+        """Record a question/answer pair, compact old turns and persist."""
+        conversation.turns.append(ConversationTurn(role="user", content=question))
+        conversation.turns.append(ConversationTurn(role="assistant", content=answer))
+        conversation.updated_at = time.time()
+        self._compact(conversation)
+        self._save(conversation)
+
+    def _compact(self, conversation: Conversation):
+        turn_tokens = sum(estimate_tokens(turn.content) for turn in conversation.turns)
+
+        # Fold the oldest exchanges into the summary until the verbatim tail
+        # fits; whole question/answer pairs, so the tail never opens with an answer
+        while len(conversation.turns) > 1 and (
+            len(conversation.turns) > self.recent_turns or turn_tokens > self.turn_token_budget
+        ):
+            turns = conversation.turns
+            count = 2 if turns[0].role == "user" and turns[1].role == "assistant" else 1
+            if count >= len(turns):
+                break
+            for turn in turns[:count]:
+                turn_tokens -= estimate_tokens(turn.content)
+                conversation.summary_lines.append(self._summarize_turn(turn))
+            del turns[:count]
+
+        # An oversized last exchange is cut down rather than dropped, the answer first
+        for turn in reversed(conversation.turns):
+            if turn_tokens <= self.turn_token_budget:
+                break
+            others = turn_tokens - estimate_tokens(turn.content)
+            turn.content = _truncate(turn.content, max(self.turn_token_budget - others, self.turn_token_budget // 4) * 4)
+            turn_tokens = others + estimate_tokens(turn.content)
+
+        while conversation.summary_lines and (
+            sum(estimate_tokens(line) for line in conversation.summary_lines) > self.summary_token_budget
+        ):
+            conversation.summary_lines.pop(0)
+
+    @staticmethod
+    def _summarize_turn(turn: ConversationTurn) -> str:
+        if turn.role == "user":
+            return f"User asked: {_truncate(turn.content, 200)}"
+        # Keep the lead sentence of the answer, stripped of Markdown decoration
+        plain = re.sub(r'[#*`>_]+', '', turn.content)
+        first_sentence = re.split(r'(?<=[.!?])\s', " ".join(plain.split()), maxsplit=1)[0]
+        return f"Assistant answered: {_truncate(first_sentence, 200)}"
+
+    def history_messages(self, conversation: Conversation) -> List[Dict[str, str]]:
+        """Chat messages representing the conversation so far, within the token bound."""
+        messages = []
+        if conversation.summary_lines:
+            messages.append({
+                "role": "system",
+                "content": SUMMARY_HEADER + "\n".join(conversation.summary_lines)
+            })
+        messages.extend({"role": turn.role, "content": turn.content} for turn in conversation.turns)
+        return messages
+
+    def condense_query(self, conversation: Conversation, question: str) -> str:
+        """Build a standalone retrieval query for a follow-up question.
+
+        Follow-ups such as "how does it scale?" retrieve poorly on their own, so
+        the key terms of the previous user question are appended to them.
+        """
+        previous = [turn.content for turn in conversation.turns if turn.role == "user"]
+        if not previous:
+            previous = [line[len("User asked: "):] for line in conversation.summary_lines if line.startswith("User asked: ")]
+        if not previous:
+            return question
+
+        words = re.findall(r"\w+", question.lower())
+        content_words = [word for word in words if word not in STOP_WORDS and word not in FOLLOW_UP_WORDS]
+        is_follow_up = any(word in FOLLOW_UP_WORDS for word in words) or len(content_words) <= 2
+        if not is_follow_up:
+            return question
+
+        context_terms = []
+        for word in re.findall(r"\w+", previous[-1].lower()):
+            if word not in STOP_WORDS and word not in FOLLOW_UP_WORDS and len(word) > 2 \
+                    and word not in content_words and word not in context_terms:
+                context_terms.append(word)
+        return f"{question} {' '.join(context_terms[:8])}".strip()
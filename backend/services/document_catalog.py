@@ -0,0 +1,183 @@
+import hashlib
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from models.chat import DocumentChunk
+
+# Bookkeeping fields that are persisted but not part of the public listing
+INTERNAL_FIELDS = ("seq", "first_chunk_seq", "last_chunk_seq")
+
+def decode_cursor(cursor: Optional[str]) -> int:
+    """Turn an opaque pagination cursor back into the sequence number it encodes."""
+    if not cursor:
+        return 0
+    try:
+        value = int(cursor)
+    except ValueError:
+        raise ValueError(f"Invalid cursor '{cursor}'")
+    if value < 0:
+        raise ValueError(f"Invalid cursor '{cursor}'")
+    return value
+
+class SequenceIndex:
+    """Keys ordered by a monotonically increasing sequence number.
+
+    Appends and cursor lookups are O(log n); a page costs O(log n + limit)
+    no matter how many entries exist, which is what keeps paginated
+    listings independent of corpus size.
+    """
+
+    def __init__(self):
+        self._seqs: List[int] = []
+        self._keys: Dict[int, str] = {}
+
+    def __len__(self) -> int:
+        return len(self._seqs)
+
+    def append(self, seq: int, key: str):
+        if self._seqs and seq <= self._seqs[-1]:
+            raise ValueError("Sequence numbers must increase")
+        self._seqs.append(seq)
+        self._keys[seq] = key
+
+    def position(self, seq: int) -> int:
+        """Rank of ``seq`` among the stored sequence numbers."""
+        return bisect_left(self._seqs, seq)
+
+    def key_at(self, position: int) -> str:
+        return self._keys[self._seqs[position]]
+
+    def pop_range(self, first: int, last: int) -> List[str]:
+        """Remove every entry with ``first <= seq <= last`` and return their keys."""
+        lo = bisect_left(self._seqs, first)
+        hi = bisect_right(self._seqs, last)
+        keys = [self._keys.pop(seq) for seq in self._seqs[lo:hi]]
+        del self._seqs[lo:hi]
+        return keys
+
+    def page(self, after: int, limit: int) -> List[Tuple[int, str]]:
+        """Entries with a sequence number greater than ``after``, at most ``limit``."""
+        start = bisect_right(self._seqs, after)
+        return [(seq, self._keys[seq]) for seq in self._seqs[start:start + limit]]
+
+class DocumentCatalog:
+    """Per-document aggregates, updated incrementally as documents come and go.
+
+    Each entry records the document's chunk count (and how many of those
+    were near-duplicates), text size, content hash, creation time and the
+    contiguous range of chunk sequence numbers its chunks were given, so
+    listing documents never has to touch chunks.
+    """
+
+    def __init__(self):
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._order = SequenceIndex()
+        self._next_seq = 1
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._entries
+
+    def get(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        return self._entries.get(doc_id)
+
+    def describe(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        """The public listing of one document, as returned by ``page``."""
+        entry = self._entries.get(doc_id)
+        if entry is None:
+            return None
+        return {key: value for key, value in entry.items() if key not in INTERNAL_FIELDS}
+
+    def add(
+        self,
+        doc_id: str,
+        filename: str,
+        chunks: List[DocumentChunk],
+        first_chunk_seq: int = 0,
+        created_at: Optional[str] = None,
+        duplicate_chunks: int = 0,
+    ) -> Dict[str, Any]:
+        """Register a newly added document built from ``chunks``.
+
+        ``duplicate_chunks`` counts the chunks that were near-duplicates of
+        already stored ones and so got no vector of their own.
+        """
+        content_hash = hashlib.sha256()
+        for chunk in chunks:
+            content_hash.update(chunk.content.encode('utf-8'))
+
+        entry = {
+            "doc_id": doc_id,
+            "filename": filename,
+            "chunk_count": len(chunks),
+            "duplicate_chunks": duplicate_chunks,
+            "size_bytes": sum(len(chunk.content.encode('utf-8')) for chunk in chunks),
+            "content_hash": content_hash.hexdigest(),
+            "created_at": created_at or datetime.now(timezone.utc).isoformat(),
+            "first_chunk_seq": first_chunk_seq,
+            "last_chunk_seq": first_chunk_seq + len(chunks) - 1,
+        }
+        self._insert(entry)
+        return entry
+
+    def _insert(self, entry: Dict[str, Any]):
+        # Keep a persisted sequence number so cursors survive a restart
+        if entry.get("seq", 0) < self._next_seq:
+            entry["seq"] = self._next_seq
+        self._next_seq = entry["seq"] + 1
+        self._entries[entry["doc_id"]] = entry
+        self._order.append(entry["seq"], entry["doc_id"])
+
+    def remove(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.pop(doc_id, None)
+        if entry is not None:
+            self._order.pop_range(entry["seq"], entry["seq"])
+        return entry
+
+    def count_promoted(self, doc_ids: Iterable[str]):
+        """Count one near-duplicate chunk less for each occurrence of a document in ``doc_ids``.
+
+        Called when duplicates take over as canonical after the document
+        holding their canonical chunk was deleted.
+        """
+        for doc_id in doc_ids:
+            entry = self._entries.get(doc_id)
+            if entry is not None:
+                entry["duplicate_chunks"] -= 1
+
+    def page(self, cursor: Optional[str] = None, limit: int = 100) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """One page of entries in insertion order plus the cursor of the next page."""
+        page = self._order.page(decode_cursor(cursor), limit)
+        entries = [
+            {key: value for key, value in self._entries[doc_id].items() if key not in INTERNAL_FIELDS}
+            for _, doc_id in page
+        ]
+        next_cursor = str(page[-1][0]) if len(page) == limit else None
+        return entries, next_cursor
+
+    def reset_chunk_ranges(self, chunk_docs: Iterable[Tuple[int, str]]):
+        """Re-derive each document's chunk range from (chunk seq, doc_id) pairs.
+
+        Chunk sequence numbers are reassigned when a store is loaded, so the
+        ranges recorded at insert time are refreshed from the loaded order.
+        """
+        ranges: Dict[str, Tuple[int, int]] = {}
+        for seq, doc_id in chunk_docs:
+            first, _ = ranges.get(doc_id, (seq, seq))
+            ranges[doc_id] = (first, seq)
+        for doc_id, entry in self._entries.items():
+            entry["first_chunk_seq"], entry["last_chunk_seq"] = ranges.get(doc_id, (1, 0))
+
+    def to_dict(self) -> Dict[str, Dict[str, Any]]:
+        return dict(self._entries)
+
+    @classmethod
+    def from_entries(cls, entries: Iterable[Dict[str, Any]]) -> "DocumentCatalog":
+        """Rebuild a catalogue from persisted entries, keeping their original order."""
+        catalog = cls()
+        for entry in sorted(entries, key=lambda e: e.get("seq", 0)):
+            catalog._insert(dict(entry))
+        return catalog
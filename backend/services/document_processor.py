@@ -1,10 +1,10 @@
 import os
 import uuid
+import asyncio
 from typing import List
-import PyPDF2
-from docx import Document
 import aiofiles
 from models.chat import DocumentChunk
+from services.extractors import PdfExtractor, get_extractor
 
 class DocumentProcessor:
     """Handles document parsing and text extraction."""
@@ -12,6 +12,12 @@ class DocumentProcessor:
     def __init__(self):
         self.chunk_size = 1000
         self.chunk_overlap = 200
+        self.pdf_extractor = PdfExtractor()
+        self.docx_extractor = get_extractor("docx", os.getenv("DOCX_EXTRACTOR", "auto"))
+    
+    def close(self):
+        """Stop the PDF extraction worker pool."""
+        self.pdf_extractor.close()
     
     async def process_document(self, file_path: str) -> List[DocumentChunk]:
         """Process a document and return text chunks."""
@@ -31,20 +37,12 @@ class DocumentProcessor:
     
     async def _extract_pdf_text(self, file_path: str) -> str:
         """Extract text from PDF file."""
-        text = ""
-        with open(file_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            for page in pdf_reader.pages:
-                text += page.extract_text() + "\n"
-        return text
+        # Off the event loop: large PDFs are extracted in parallel across processes
+        return await asyncio.to_thread(self.pdf_extractor.extract, file_path)
     
     async def _extract_docx_text(self, file_path: str) -> str:
         """Extract text from DOCX file."""
-        doc = Document(file_path)
-        text = ""
-        for paragraph in doc.paragraphs:
-            text += paragraph.text + "\n"
-        return text
+        return await asyncio.to_thread(self.docx_extractor.extract, file_path)
     
     async def _extract_txt_text(self, file_path: str) -> str:
         """Extract text from TXT file."""
@@ -0,0 +1,6 @@
+# Text extraction backends, registered per file type
+from services.extractors.registry import EXTRACTORS, available_extractors, get_extractor, register_extractor
+from services.extractors.pdf import PdfExtractor
+from services.extractors import docx  # noqa: F401  (registers the DOCX backends)
+
+__all__ = ["EXTRACTORS", "available_extractors", "get_extractor", "register_extractor", "PdfExtractor"]
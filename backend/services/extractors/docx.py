@@ -0,0 +1,35 @@
+import logging
+
+from services.extractors.registry import register_extractor
+
+logger = logging.getLogger(__name__)
+
+# Import the DOCX libraries with error handling; each backend needs only its own
+try:
+    import docx2txt
+    DOCX2TXT_AVAILABLE = True
+except ImportError:
+    DOCX2TXT_AVAILABLE = False
+
+try:
+    from docx import Document
+    PYTHON_DOCX_AVAILABLE = True
+except ImportError:
+    PYTHON_DOCX_AVAILABLE = False
+
+@register_extractor("docx", "docx2txt", available=DOCX2TXT_AVAILABLE)
+class Docx2TxtExtractor:
+    """Regex pass over the document XML; fast, and also picks up tables and headers."""
+
+    @staticmethod
+    def extract(file_path: str) -> str:
+        return docx2txt.process(file_path)
+
+@register_extractor("docx", "python-docx", available=PYTHON_DOCX_AVAILABLE)
+class PythonDocxExtractor:
+    """Body paragraphs via the python-docx object model."""
+
+    @staticmethod
+    def extract(file_path: str) -> str:
+        doc = Document(file_path)
+        return "".join(paragraph.text + "\n" for paragraph in doc.paragraphs)
@@ -0,0 +1,279 @@
+import io
+import os
+import math
+import time
+import signal
+import logging
+import threading
+import multiprocessing
+from collections import OrderedDict
+from typing import Any, List, Optional, Tuple
+
+from services.extractors.registry import get_extractor, register_extractor
+
+logger = logging.getLogger(__name__)
+
+# Import the PDF libraries with error handling; each backend needs only its own
+try:
+    import fitz  # PyMuPDF
+    PYMUPDF_AVAILABLE = True
+except ImportError:
+    PYMUPDF_AVAILABLE = False
+
+try:
+    import PyPDF2
+    PYPDF2_AVAILABLE = True
+except ImportError:
+    PYPDF2_AVAILABLE = False
+
+try:
+    from pdfminer.converter import TextConverter
+    from pdfminer.layout import LAParams
+    from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+    from pdfminer.pdfpage import PDFPage
+    PDFMINER_AVAILABLE = True
+except ImportError:
+    PDFMINER_AVAILABLE = False
+
+# AGPL-licensed and not in requirements.txt, so only used when selected by name
+@register_extractor("pdf", "pymupdf", available=PYMUPDF_AVAILABLE, auto=False)
+class PyMuPDFBackend:
+    """MuPDF bindings; native code and by far the fastest backend."""
+
+    def __init__(self, file_path: str):
+        self._doc = fitz.open(file_path)
+
+    def page_count(self) -> int:
+        return self._doc.page_count
+
+    def page_text(self, number: int) -> str:
+        return self._doc.load_page(number).get_text()
+
+    def close(self):
+        self._doc.close()
+
+@register_extractor("pdf", "pypdf2", available=PYPDF2_AVAILABLE)
+class PyPDF2Backend:
+    """Pure-Python PyPDF2 reader."""
+
+    def __init__(self, file_path: str):
+        self._file = open(file_path, 'rb')
+        self._reader = PyPDF2.PdfReader(self._file)
+
+    def page_count(self) -> int:
+        return len(self._reader.pages)
+
+    def page_text(self, number: int) -> str:
+        return self._reader.pages[number].extract_text()
+
+    def close(self):
+        self._file.close()
+
+@register_extractor("pdf", "pdfminer", available=PDFMINER_AVAILABLE)
+class PdfMinerBackend:
+    """pdfminer.six with layout analysis; slow, but the most faithful reading order."""
+
+    def __init__(self, file_path: str):
+        self._file = open(file_path, 'rb')
+        self._pages = list(PDFPage.get_pages(self._file))
+        self._resources = PDFResourceManager()
+
+    def page_count(self) -> int:
+        return len(self._pages)
+
+    def page_text(self, number: int) -> str:
+        output = io.StringIO()
+        converter = TextConverter(self._resources, output, laparams=LAParams())
+        try:
+            PDFPageInterpreter(self._resources, converter).process_page(self._pages[number])
+        finally:
+            converter.close()
+        return output.getvalue()
+
+    def close(self):
+        self._file.close()
+
+class PageTimeout(Exception):
+    pass
+
+# Documents a pool worker has open, least recently used first; keyed by
+# backend, path and file identity so a rewritten file is opened afresh
+_worker_documents: "OrderedDict[tuple, Any]" = OrderedDict()
+_WORKER_OPEN_DOCUMENTS = 2
+
+def _init_worker():
+    # Cancellation is the parent's job (it terminates the pool)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def _worker_document(backend_name: str, file_path: str):
+    stat = os.stat(file_path)
+    key = (backend_name, file_path, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+    document = _worker_documents.pop(key, None)
+    if document is None:
+        document = get_extractor("pdf", backend_name)(file_path)
+    _worker_documents[key] = document
+    while len(_worker_documents) > _WORKER_OPEN_DOCUMENTS:
+        _, oldest = _worker_documents.popitem(last=False)
+        oldest.close()
+    return document
+
+# Reason given for a page that ran out of time
+TIMED_OUT = "timed out"
+
+def _raise_page_timeout(signum, frame):
+    raise PageTimeout()
+
+def _page_count(backend_name: str, file_path: str) -> int:
+    """Open a document in a pool worker, which keeps it open for its pages."""
+    return _worker_document(backend_name, file_path).page_count()
+
+def _extract_pages(backend_name: str, file_path: str, numbers: List[int], timeout: float) -> List[Tuple[str, Optional[str]]]:
+    """Extract pages in a pool worker; returns (text, why there is none) per page."""
+    document = _worker_document(backend_name, file_path)
+    # The alarm interrupts pages stuck in Python code; pages stuck in native
+    # code are caught by the parent's overall deadline instead
+    use_alarm = timeout > 0 and hasattr(signal, "setitimer")
+    if use_alarm:
+        signal.signal(signal.SIGALRM, _raise_page_timeout)
+    pages = []
+    for number in numbers:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, timeout)
+        try:
+            pages.append((document.page_text(number), None))
+        except PageTimeout:
+            pages.append(("", TIMED_OUT))
+        except Exception as e:
+            pages.append(("", str(e)))
+        finally:
+            if use_alarm:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+    return pages
+
+def _pool_context():
+    # Forking a multi-threaded server process is unsafe; a fork server is
+    # started once and then forks cheap single-threaded workers
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload([__name__])
+        return context
+    return multiprocessing.get_context("spawn")
+
+class PdfExtractor:
+    """Extracts PDF text page by page with a configurable backend.
+
+    Extraction runs in a process pool that is started on first use and
+    kept for later documents, with each worker keeping the last few files
+    it opened. Documents with at least ``parallel_min_pages`` pages are
+    spread over the pool one page per task; smaller ones go to a single
+    worker as one task. The document is opened to count its pages in the
+    pool as well, within one page timeout, since opening can hang too.
+    Every page gets ``page_timeout`` seconds either
+    way; a page that times out or fails contributes no text instead of
+    stalling or failing the whole upload. If a worker overruns the overall
+    deadline it may be stuck in native code, so the pool is terminated and
+    the next document starts a fresh one. Pages are reassembled in page
+    order.
+    """
+
+    def __init__(
+        self,
+        backend: Optional[str] = None,
+        workers: Optional[int] = None,
+        parallel_min_pages: Optional[int] = None,
+        page_timeout: Optional[float] = None,
+    ):
+        self.backend = get_extractor("pdf", backend or os.getenv("PDF_EXTRACTOR", "auto"))
+        self.workers = workers or int(os.getenv("PDF_EXTRACT_WORKERS", "0")) or os.cpu_count() or 1
+        self.parallel_min_pages = parallel_min_pages or int(os.getenv("PDF_PARALLEL_MIN_PAGES", "16"))
+        self.page_timeout = page_timeout if page_timeout is not None else float(os.getenv("PDF_PAGE_TIMEOUT_SECONDS", "10"))
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        # Documents being extracted; they share the pool, which stretches each one's deadline
+        self._active = 0
+        logger.info(f"PDF extraction backend: {self.backend.name}")
+
+    def extract(self, file_path: str) -> str:
+        """Text of the whole document, one line break after each page."""
+        return "".join(page + "\n" for page in self.extract_pages(file_path))
+
+    def extract_pages(self, file_path: str, parallel: Optional[bool] = None) -> List[str]:
+        started = time.monotonic()
+        pool, sharing = self._acquire_pool()
+        stuck = False
+        try:
+            args = (self.backend.name, file_path)
+            try:
+                page_count = pool.apply_async(_page_count, args).get(self.page_timeout * sharing if self.page_timeout > 0 else None)
+            except multiprocessing.TimeoutError:
+                stuck = True
+                raise TimeoutError(f"Timed out opening PDF {file_path}")
+            if not page_count:
+                return []
+            if parallel is None:
+                parallel = self.workers > 1 and page_count >= self.parallel_min_pages
+            workers = min(self.workers, page_count) if parallel else 1
+            pages, failed, stuck = self._extract(pool, sharing, args, page_count, workers)
+        finally:
+            self._release_pool(pool, stuck)
+
+        elapsed = time.monotonic() - started
+        logger.info(f"Extracted {page_count} PDF pages with {workers} workers in {elapsed:.2f}s ({failed} empty or failed)")
+        return pages
+
+    def close(self):
+        """Terminate the worker pool, if one is running."""
+        with self._pool_lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+    def _acquire_pool(self) -> Tuple[Any, int]:
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = _pool_context().Pool(self.workers, initializer=_init_worker)
+            self._active += 1
+            return self._pool, self._active
+
+    def _release_pool(self, pool, stuck: bool):
+        with self._pool_lock:
+            self._active -= 1
+            if not stuck or self._pool is not pool:
+                return
+            self._pool = None
+        logger.warning("Terminating the PDF extraction pool: a worker overran its deadline")
+        pool.terminate()
+        pool.join()
+
+    def _extract(self, pool, sharing: int, args: Tuple[str, str], page_count: int, workers: int) -> Tuple[List[str], int, bool]:
+        """Extract every page; returns the texts, how many are empty and whether a worker got stuck."""
+        started = time.monotonic()
+        if workers > 1:
+            tasks = [([number], pool.apply_async(_extract_pages, (*args, [number], self.page_timeout))) for number in range(page_count)]
+        else:
+            numbers = list(range(page_count))
+            tasks = [(numbers, pool.apply_async(_extract_pages, (*args, numbers, self.page_timeout)))]
+        # Worst case every page runs into its timeout; one more allows for
+        # the other workers opening the file, and documents extracted
+        # concurrently take turns
+        rounds = (math.ceil(page_count / workers) + 1) * sharing
+        deadline = started + self.page_timeout * rounds if self.page_timeout > 0 else None
+        pages, failed, stuck = [], 0, False
+        for numbers, result in tasks:
+            try:
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                extracted = result.get(timeout)
+            except multiprocessing.TimeoutError:
+                stuck = True
+                extracted = [("", TIMED_OUT)] * len(numbers)
+            except Exception as e:
+                extracted = [("", str(e))] * len(numbers)
+            for number, (text, error) in zip(numbers, extracted):
+                if error == TIMED_OUT:
+                    logger.warning(f"Timed out extracting PDF page {number + 1} of {args[1]}")
+                elif error:
+                    logger.warning(f"Skipping PDF page {number + 1}: {error}")
+                failed += not text
+                pages.append(text)
+        return pages, failed, stuck
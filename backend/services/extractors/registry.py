@@ -0,0 +1,37 @@
+import logging
+from typing import Dict, List, Optional, Type
+
+logger = logging.getLogger(__name__)
+
+# file type -> backend name -> backend class, in order of preference
+EXTRACTORS: Dict[str, Dict[str, Type]] = {}
+
+def register_extractor(file_type: str, name: str, available: bool = True, auto: bool = True):
+    """Class decorator registering a text extraction backend for ``file_type``.
+
+    Backends register in order of preference; ``available`` is False when the
+    library a backend wraps is not installed. A backend with ``auto`` False
+    is only used when asked for by name, unless no other one is installed.
+    """
+    def decorator(cls: Type) -> Type:
+        cls.name = name
+        cls.available = available
+        cls.auto = auto
+        EXTRACTORS.setdefault(file_type, {})[name] = cls
+        return cls
+    return decorator
+
+def available_extractors(file_type: str) -> List[str]:
+    return [name for name, cls in EXTRACTORS.get(file_type, {}).items() if cls.available]
+
+def get_extractor(file_type: str, name: Optional[str] = None) -> Type:
+    """Backend class for ``file_type``: ``name`` if given and usable, else the preferred one."""
+    available = available_extractors(file_type)
+    if not available:
+        raise ValueError(f"No text extractor available for {file_type} files")
+    preferred = next((n for n in available if EXTRACTORS[file_type][n].auto), available[0])
+    if name and name != "auto":
+        if name in available:
+            return EXTRACTORS[file_type][name]
+        logger.warning(f"{file_type} extractor '{name}' is not available, using '{preferred}' (available: {', '.join(available)})")
+    return EXTRACTORS[file_type][preferred]
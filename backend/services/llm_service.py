@@ -1,17 +1,68 @@
 import os
-import httpx
 import re
-from typing import List, Dict, Any
+import json
+import time
+import asyncio
+import logging
+import httpx
+from typing import Callable, List, Dict, Any, Optional, Tuple
 from models.chat import Source
+from services.model_router import ModelRouter
+
+logger = logging.getLogger(__name__)
+
+class LLMError(Exception):
+    """An LLM request failed; ``status_code`` is the HTTP status to answer the client with."""
+    status_code = 502
+    
+    def __init__(self, message: str, kind: str = "error", retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.kind = kind
+        self.retry_after = retry_after
+
+class LLMUnavailableError(LLMError):
+    """The models are rate limited, down or switched off by their circuit breaker."""
+    status_code = 503
+
+class LLMTimeoutError(LLMError):
+    """No answer arrived before the request deadline."""
+    status_code = 504
+
+def error_for_status(model: str, status_code: int, error_text: str, retry_after: Optional[str] = None) -> LLMError:
+    message = f"{model} returned {status_code}: {error_text}"
+    if status_code == 429:
+        return LLMUnavailableError(message, "rate_limited", float(retry_after) if retry_after and retry_after.isdigit() else None)
+    if status_code >= 500:
+        return LLMUnavailableError(message, "server_error")
+    return LLMError(message, "bad_request")
 
 class LLMService:
-    """Service for interacting with LLM via OpenRouter API."""
+    """Service for interacting with LLM via OpenRouter API.
+    
+    ``LLM_MODELS`` is an ordered fallback chain. Each request has a deadline
+    (``LLM_DEADLINE_SECONDS``); requests to a model that is slow to start
+    streaming are hedged with the next model, and failures fall through to
+    it. The ``ModelRouter`` tracks per-model latency and health to decide the
+    order and the hedge delay.
+    """
     
     def __init__(self):
         self.api_key = os.getenv("OPENROUTER_API_KEY")
-        self.base_url = "https://openrouter.ai/api/v1"
-        # Use Qwen3-14B free model
-        self.model = "qwen/qwen3-14b:free"
+        # Overridable to point at a local stand-in (see benchmarks/mock_openrouter.py)
+        self.base_url = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1").rstrip("/")
+        # Use Qwen3-14B free model, optionally followed by fallbacks
+        self.models = [model.strip() for model in os.getenv("LLM_MODELS", "qwen/qwen3-14b:free").split(",") if model.strip()]
+        self.model = self.models[0]
+        self.deadline_seconds = float(os.getenv("LLM_DEADLINE_SECONDS", "30"))
+        self.max_connections = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+        self.router = ModelRouter(self.models)
+        self._client: Optional[httpx.AsyncClient] = None
+        
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.fallbacks = 0
+        self.errors: Dict[str, int] = {}
         
         # For testing, temporarily use mock mode due to OpenRouter connectivity issues
         self.mock_mode = False  # Enable real API mode
@@ -35,8 +86,22 @@ class LLMService:
         
         return highlighted_text
     
-    async def generate_response(self, question: str, context_docs: List[Source]) -> Dict[str, Any]:
-        """Generate a response using the LLM with RAG context."""
+    async def generate_response(
+        self,
+        question: str,
+        context_docs: List[Source],
+        history: Optional[List[Dict[str, str]]] = None,
+        deadline: Optional[float] = None,
+        on_first_token: Optional[Callable[[], None]] = None
+    ) -> Dict[str, Any]:
+        """Generate a response using the LLM with RAG context.
+
+        ``history`` holds earlier chat messages of the conversation, already
+        bounded by the conversation store, and is sent ahead of the question.
+        ``deadline`` is a ``time.monotonic()`` instant (default: the configured
+        deadline from now). ``on_first_token`` is called once the answer
+        starts streaming. Raises ``LLMError`` if no model answers in time.
+        """
         
         # If in mock mode, return a test response
         if self.mock_mode:
@@ -48,7 +113,8 @@ class LLMService:
                     highlighted_source = Source(
                         document_name=doc.document_name,
                         chunk_text=highlighted_chunk_text,
-                        score=doc.score
+                        score=doc.score,
+                        duplicate_sources=doc.duplicate_sources
                     )
                     highlighted_sources.append(highlighted_source)
                 
@@ -122,77 +188,235 @@ Question: {question}
 
 Please provide a comprehensive answer based on the context documents above. If the context doesn't contain sufficient information to answer the question, please state that clearly."""
 
-        # Make API call to OpenRouter
-        async with httpx.AsyncClient() as client:
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json",
-                "HTTP-Referer": "http://localhost:3000",  # Fixed: use http instead of https
-                "X-Title": "GenAI RAG Chatbot"
-            }
-            
-            payload = {
-                "model": self.model,
-                "messages": [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                "temperature": 0.7,
-                "max_tokens": 1000,
-                "stream": False  # Explicitly disable streaming
-            }
-            
-            try:
-                print(f"Making API call to OpenRouter with {len(context_docs)} context docs...")
-                print(f"Using model: {self.model}")
-                
-                response = await client.post(
-                    f"{self.base_url}/chat/completions",
-                    headers=headers,
-                    json=payload,
-                    timeout=15.0
-                )
-                print(f"API response status: {response.status_code}")
+        messages = [
+            {"role": "system", "content": system_prompt},
+            *(history or []),
+            {"role": "user", "content": user_prompt}
+        ]
+        if deadline is None:
+            deadline = time.monotonic() + self.deadline_seconds
+        
+        self.requests += 1
+        try:
+            answer, model = await self._complete(messages, deadline, on_first_token)
+        except LLMError as e:
+            self.errors[e.kind] = self.errors.get(e.kind, 0) + 1
+            raise
+        logger.info(f"Generated answer with {model}: {answer[:100]}...")
+        
+        # Create highlighted sources with keywords emphasized
+        highlighted_sources = []
+        for doc in context_docs:
+            highlighted_chunk_text = self._highlight_keywords(doc.chunk_text, question)
+            highlighted_source = Source(
+                document_name=doc.document_name,
+                chunk_text=highlighted_chunk_text,
+                score=doc.score,
+                duplicate_sources=doc.duplicate_sources
+            )
+            highlighted_sources.append(highlighted_source)
+        
+        return {
+            "answer": answer,  # LLM already provides well-formatted response
+            "sources": highlighted_sources,
+            "model": model
+        }
+    
+    async def _complete(self, messages: List[Dict[str, str]], deadline: float, on_first_token: Optional[Callable[[], None]] = None) -> Tuple[str, str]:
+        """Run the hedged fallback chain; returns the answer and the model that gave it.
+        
+        The best model is asked first. If it has not produced a first token
+        within its hedge delay, the next model is asked as well, and whichever
+        streams first wins while the other request is cancelled. A failed
+        request falls through to the next model while time remains.
+        """
+        models = self.router.order(deadline)
+        if not models:
+            raise LLMUnavailableError("All models are temporarily unavailable", "circuit_open", self.router.retry_after())
+        
+        loop = asyncio.get_running_loop()
+        entered = time.monotonic()
+        # task -> model, first token future, launch time
+        attempts: Dict[asyncio.Task, Tuple[str, asyncio.Future, float]] = {}
+        chosen: Optional[asyncio.Task] = None
+        last_error: Optional[LLMError] = None
+        hedge_at = 0.0
+        timed_out = False
+        streaming = False
+        
+        def launch(model: str):
+            nonlocal hedge_at
+            first_token = loop.create_future()
+            task = asyncio.create_task(self._stream_completion(model, messages, deadline, first_token))
+            attempts[task] = (model, first_token, time.monotonic())
+            hedge_at = time.monotonic() + self.router.hedge_delay(model)
+        
+        def cancel(task: asyncio.Task):
+            model, first_token, launched = attempts[task]
+            task.cancel()
+            self.router.record_cancelled(model, None if first_token.done() else time.monotonic() - launched)
+        
+        first_model = models[0]
+        launch(models.pop(0))
+        try:
+            while attempts:
+                now = time.monotonic()
+                if now >= deadline:
+                    # Running out the deadline counts against the model
+                    timed_out = True
+                    for task, (model, _, _) in attempts.items():
+                        if not task.done():
+                            self.router.record_failure(model, "timeout")
+                    raise LLMTimeoutError(f"No answer within the {deadline - entered:.1f}s left before the request deadline", "deadline")
                 
-                if response.status_code != 200:
-                    error_text = response.text
-                    print(f"Error response: {error_text}")
-                    return {
-                        "answer": f"API Error ({response.status_code}): {error_text}",
-                        "sources": []
-                    }
+                # Hedge at most one extra request, and only until a model is streaming
+                can_hedge = chosen is None and bool(models) and len(attempts) < 2
+                waitables = set(attempts)
+                if chosen is None:
+                    waitables |= {first_token for _, first_token, _ in attempts.values()}
+                timeout = deadline - now
+                if can_hedge:
+                    timeout = min(timeout, max(0.0, hedge_at - now))
+                await asyncio.wait(waitables, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
                 
-                result = response.json()
-                answer = result["choices"][0]["message"]["content"]
-                print(f"Generated answer: {answer[:100]}...")
+                for task in [task for task in attempts if task.done()]:
+                    model, _, _ = attempts.pop(task)
+                    if task is chosen:
+                        chosen = None
+                    if task.cancelled():
+                        continue
+                    try:
+                        answer = task.result()
+                    except LLMError as e:
+                        last_error = e
+                        continue
+                    if not streaming and on_first_token is not None:
+                        on_first_token()
+                    return answer, model
                 
-                # Create highlighted sources with keywords emphasized
-                highlighted_sources = []
-                for doc in context_docs:
-                    highlighted_chunk_text = self._highlight_keywords(doc.chunk_text, question)
-                    highlighted_source = Source(
-                        document_name=doc.document_name,
-                        chunk_text=highlighted_chunk_text,
-                        score=doc.score
-                    )
-                    highlighted_sources.append(highlighted_source)
+                if chosen is None:
+                    for task, (model, first_token, _) in attempts.items():
+                        if first_token.done():
+                            chosen = task
+                            if not streaming and on_first_token is not None:
+                                on_first_token()
+                            streaming = True
+                            if len(attempts) > 1:
+                                self.hedge_wins += model != first_model
+                                for other in [other for other in attempts if other is not task]:
+                                    cancel(other)
+                                    del attempts[other]
+                            break
                 
-                return {
-                    "answer": answer,  # LLM already provides well-formatted response
-                    "sources": highlighted_sources
-                }
+                if not attempts and models:
+                    self.fallbacks += 1
+                    launch(models.pop(0))
+                elif can_hedge and chosen is None and time.monotonic() >= hedge_at:
+                    self.hedges += 1
+                    launch(models.pop(0))
+        finally:
+            for task in attempts:
+                if not task.done():
+                    if timed_out:
+                        task.cancel()
+                    else:
+                        cancel(task)
+                elif not task.cancelled():
+                    task.exception()  # Already recorded; don't log it as never retrieved
+        
+        if last_error is None:
+            # Every request was cancelled without an answer or an error
+            raise LLMUnavailableError("No model request completed", "cancelled", self.router.retry_after())
+        if isinstance(last_error, LLMUnavailableError):
+            last_error.retry_after = max(last_error.retry_after or 0.0, self.router.retry_after())
+        raise last_error
+    
+    def _get_client(self) -> httpx.AsyncClient:
+        # One pooled client for all requests, so connections are reused
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections)
+            )
+        return self._client
+    
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+    
+    async def _stream_completion(self, model: str, messages: List[Dict[str, str]], deadline: float, first_token: asyncio.Future) -> str:
+        """Stream one chat completion; resolves ``first_token`` when output starts."""
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+            "HTTP-Referer": "http://localhost:3000",  # Fixed: use http instead of https
+            "X-Title": "GenAI RAG Chatbot"
+        }
+        payload = {
+            "model": model,
+            "messages": messages,
+            "temperature": 0.7,
+            "max_tokens": 1000,
+            "stream": True  # Streaming reveals the time to first token
+        }
+        
+        started = time.monotonic()
+        self.router.started(model)
+        try:
+            parts = []
+            # The deadline is enforced by _complete; this only bounds a stalled connection
+            timeout = httpx.Timeout(max(0.1, deadline - started) + 1.0, connect=5.0)
+            async with self._get_client().stream(
+                "POST", f"{self.base_url}/chat/completions", headers=headers, json=payload, timeout=timeout
+            ) as response:
+                if response.status_code != 200:
+                    error_text = (await response.aread()).decode('utf-8', errors='replace')[:500]
+                    raise error_for_status(model, response.status_code, error_text, response.headers.get("Retry-After"))
                 
-            except httpx.HTTPError as e:
-                print(f"HTTP error: {e}")
-                return {
-                    "answer": f"Sorry, I encountered an HTTP error: {str(e)}",
-                    "sources": []
-                }
-            except Exception as e:
-                print(f"Unexpected error: {e}")
-                import traceback
-                traceback.print_exc()
-                return {
-                    "answer": f"Sorry, an unexpected error occurred: {str(e)}",
-                    "sources": []
-                }
+                async for line in response.aiter_lines():
+                    # SSE comments (": OPENROUTER PROCESSING") keep the connection alive
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+                    chunk = json.loads(data)
+                    if "error" in chunk:
+                        raise LLMError(f"{model} failed mid-stream: {chunk['error']}", "stream_error")
+                    delta = chunk["choices"][0].get("delta", {})
+                    if not first_token.done() and (delta.get("content") or delta.get("reasoning")):
+                        self.router.record_first_token(model, time.monotonic() - started)
+                        first_token.set_result(model)
+                    parts.append(delta.get("content") or "")
+            
+            answer = "".join(parts)
+            if not answer:
+                raise LLMError(f"{model} returned an empty answer", "empty_answer")
+            self.router.record_success(model, time.monotonic() - started)
+            return answer
+        
+        except LLMError as e:
+            logger.warning(f"LLM request to {model} failed: {e}")
+            self.router.record_failure(model, e.kind)
+            raise
+        except httpx.TimeoutException:
+            self.router.record_failure(model, "timeout")
+            raise LLMTimeoutError(f"{model} timed out", "timeout")
+        except (httpx.HTTPError, ValueError, KeyError, IndexError) as e:
+            # Connection failures and malformed stream data
+            logger.warning(f"LLM request to {model} failed: {e}")
+            kind = "connection" if isinstance(e, httpx.HTTPError) else "bad_response"
+            self.router.record_failure(model, kind)
+            if kind == "connection":
+                raise LLMUnavailableError(f"Could not reach {model}: {e}", kind)
+            raise LLMError(f"Malformed response from {model}: {e}", kind)
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "fallbacks": self.fallbacks,
+            "errors": self.errors,
+            "models": self.router.to_dict(),
+        }
@@ -0,0 +1,187 @@
+import os
+import time
+import logging
+from collections import deque
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+class ModelStats:
+    """Latency and health of one model, from the outcomes of recent calls.
+
+    Time to first token is kept as a moving average plus a window of recent
+    samples for its tail. A request cancelled before its first token (a
+    hedge loser) contributes the time it waited, a lower bound, so a model
+    that keeps losing still shows up as slow. When at least
+    ``failure_rate`` of the last ``breaker_window`` calls failed (and at
+    least ``min_requests`` were made) the circuit opens and the model is not routed to for ``cooldown``
+    seconds; then a single probe request is let through, whose outcome
+    closes or re-opens the circuit.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_rate: float,
+        min_requests: int,
+        cooldown: float,
+        breaker_window: int = 20,
+        window: int = 100,
+    ):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_requests = min_requests
+        self.cooldown = cooldown
+        self.outcomes: deque = deque(maxlen=breaker_window)
+        self.first_token_ewma: Optional[float] = None
+        self.total_ewma: Optional[float] = None
+        self.first_token_samples: deque = deque(maxlen=window)
+        self.open_until = 0.0
+        self.probing = False
+        self.requests = 0
+        self.successes = 0
+        self.failures: Dict[str, int] = {}
+        self.cancelled = 0
+
+    def is_available(self, now: float) -> bool:
+        if self.open_until == 0.0:
+            return True
+        # Half-open: one probe at a time once the cooldown is over
+        return now >= self.open_until and not self.probing
+
+    def first_token_percentile(self, fraction: float) -> Optional[float]:
+        if not self.first_token_samples:
+            return None
+        samples = sorted(self.first_token_samples)
+        return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+    def expected_first_token(self, default: float = 0.0) -> float:
+        return self.first_token_ewma if self.first_token_ewma is not None else default
+
+    def started(self, now: float):
+        self.requests += 1
+        if self.open_until and now >= self.open_until:
+            self.probing = True
+
+    def record_first_token(self, seconds: float):
+        self.first_token_samples.append(seconds)
+        self.first_token_ewma = seconds if self.first_token_ewma is None else 0.8 * self.first_token_ewma + 0.2 * seconds
+
+    def record_success(self, seconds: float):
+        self.successes += 1
+        self.total_ewma = seconds if self.total_ewma is None else 0.8 * self.total_ewma + 0.2 * seconds
+        self.outcomes.append(False)
+        if self.probing:
+            # The probe succeeded; start over with a clean record
+            self.outcomes.clear()
+        self.open_until = 0.0
+        self.probing = False
+
+    def record_failure(self, kind: str, now: float):
+        self.failures[kind] = self.failures.get(kind, 0) + 1
+        self.outcomes.append(True)
+        failed = sum(self.outcomes)
+        tripped = len(self.outcomes) >= self.min_requests and failed >= self.failure_rate * len(self.outcomes)
+        if self.probing or (tripped and not self.open_until):
+            logger.warning(f"Opening circuit for model {self.name} for {self.cooldown:.0f}s after {kind} ({failed}/{len(self.outcomes)} recent calls failed)")
+            self.open_until = now + self.cooldown
+        self.probing = False
+
+    def record_cancelled(self, waited: Optional[float] = None):
+        # A hedge loser says nothing about the model's health, but it was
+        # at least ``waited`` seconds from its first token
+        self.cancelled += 1
+        self.probing = False
+        if waited is not None:
+            self.record_first_token(waited)
+
+    def to_dict(self, now: float) -> dict:
+        p50, p95 = self.first_token_percentile(0.5), self.first_token_percentile(0.95)
+        return {
+            "available": self.is_available(now),
+            "circuit": "closed" if not self.open_until else ("half_open" if now >= self.open_until else "open"),
+            "requests": self.requests,
+            "successes": self.successes,
+            "failures": self.failures,
+            "cancelled": self.cancelled,
+            "first_token_ms_ewma": round(self.first_token_ewma * 1000, 1) if self.first_token_ewma is not None else None,
+            "first_token_ms_p50": round(p50 * 1000, 1) if p50 is not None else None,
+            "first_token_ms_p95": round(p95 * 1000, 1) if p95 is not None else None,
+            "total_ms_ewma": round(self.total_ewma * 1000, 1) if self.total_ewma is not None else None,
+        }
+
+class ModelRouter:
+    """Orders an LLM fallback chain by health and latency for each request.
+
+    Models are tried fastest first by observed time to first token, with
+    models not yet measured assumed to take ``hedge_after`` and ties kept in
+    configured order. Models whose circuit is open are skipped and, when a
+    deadline is given, any model whose typical time to first token would not
+    fit in the time left is moved behind the others. The hedge delay for a
+    model is the tail (p95) of its observed time to first token, or
+    ``hedge_after`` until enough samples have been collected.
+    """
+
+    def __init__(
+        self,
+        models: List[str],
+        hedge_after_ms: Optional[float] = None,
+        failure_rate: Optional[float] = None,
+        min_requests: Optional[int] = None,
+        cooldown_seconds: Optional[float] = None,
+        min_samples: int = 20,
+    ):
+        if not models:
+            raise ValueError("At least one model is required")
+        self.models = models
+        self.hedge_after = (hedge_after_ms if hedge_after_ms is not None else float(os.getenv("LLM_HEDGE_AFTER_MS", "3000"))) / 1000.0
+        failure_rate = failure_rate or float(os.getenv("LLM_BREAKER_FAILURE_RATE", "0.5"))
+        min_requests = min_requests or int(os.getenv("LLM_BREAKER_MIN_REQUESTS", "10"))
+        cooldown_seconds = cooldown_seconds if cooldown_seconds is not None else float(os.getenv("LLM_BREAKER_COOLDOWN_SECONDS", "15"))
+        self.min_samples = min_samples
+        self.stats: Dict[str, ModelStats] = {
+            model: ModelStats(model, failure_rate, min_requests, cooldown_seconds) for model in models
+        }
+
+    def order(self, deadline: Optional[float] = None) -> List[str]:
+        """Models to try for a request, best first; empty if none is available."""
+        now = time.monotonic()
+        remaining = None if deadline is None else deadline - now
+        available = [model for model in self.models if self.stats[model].is_available(now)]
+        available.sort(key=lambda model: self.stats[model].expected_first_token(self.hedge_after))
+        if remaining is None:
+            return available
+        fits = [model for model in available if self.stats[model].expected_first_token() < remaining]
+        return fits + [model for model in available if model not in fits]
+
+    def hedge_delay(self, model: str) -> float:
+        stats = self.stats[model]
+        if len(stats.first_token_samples) < self.min_samples:
+            return self.hedge_after
+        return stats.first_token_percentile(0.95)
+
+    def retry_after(self) -> float:
+        """Seconds until the first open circuit admits a probe again."""
+        now = time.monotonic()
+        waits = [stats.open_until - now for stats in self.stats.values() if stats.open_until > now]
+        return max(1.0, min(waits)) if waits else 1.0
+
+    def started(self, model: str):
+        self.stats[model].started(time.monotonic())
+
+    def record_first_token(self, model: str, seconds: float):
+        self.stats[model].record_first_token(seconds)
+
+    def record_success(self, model: str, seconds: float):
+        self.stats[model].record_success(seconds)
+
+    def record_failure(self, model: str, kind: str):
+        self.stats[model].record_failure(kind, time.monotonic())
+
+    def record_cancelled(self, model: str, waited: Optional[float] = None):
+        """``waited`` is how long the request had gone without a first token, if it had none."""
+        self.stats[model].record_cancelled(waited)
+
+    def to_dict(self) -> dict:
+        now = time.monotonic()
+        return {model: self.stats[model].to_dict(now) for model in self.models}
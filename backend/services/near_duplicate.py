@@ -0,0 +1,235 @@
+import io
+import os
+import re
+import zlib
+from typing import Callable, Iterable, Optional, Tuple
+
+import numpy as np
+
+# Signature length and shingle size; signatures are persisted, so changing
+# either makes stored signatures incomparable with new ones
+NUM_PERM = 128
+SHINGLE_WORDS = 3
+
+_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64(0xFFFFFFFF)
+# Fixed seed: the hash functions must be the same in every process and run
+_rng = np.random.RandomState(20240601)
+_A = _rng.randint(1, 1 << 29, size=NUM_PERM, dtype=np.int64).astype(np.uint64)[:, None]
+_B = _rng.randint(0, 1 << 29, size=NUM_PERM, dtype=np.int64).astype(np.uint64)[:, None]
+
+_WORD = re.compile(r"\w+")
+
+def _shingles(text: str) -> np.ndarray:
+    """32-bit hashes of the distinct word n-grams of ``text``."""
+    words = np.array([zlib.crc32(word.encode('utf-8')) for word in _WORD.findall(text.lower())], dtype=np.uint64)
+    if len(words) >= SHINGLE_WORDS:
+        # Combine consecutive word hashes; uint64 arithmetic wraps around
+        hashes = np.zeros(len(words) - SHINGLE_WORDS + 1, dtype=np.uint64)
+        for offset in range(SHINGLE_WORDS):
+            hashes = hashes * np.uint64(1000003) + words[offset:len(words) - SHINGLE_WORDS + 1 + offset]
+        words = hashes
+    return np.unique(words & _MAX_HASH)
+
+def minhash_signature(text: str) -> np.ndarray:
+    """MinHash signature of ``text``: ``NUM_PERM`` uint32 values.
+
+    The share of positions at which two signatures agree estimates the
+    Jaccard similarity of the two texts' word shingle sets.
+    """
+    shingles = _shingles(text)
+    if not len(shingles):
+        return np.full(NUM_PERM, _MAX_HASH, dtype=np.uint32)
+    # One universal hash per permutation, applied to all shingles at once
+    return ((_A * shingles[None, :] + _B) % _PRIME & _MAX_HASH).min(axis=1).astype(np.uint32)
+
+def minhash_signatures(texts: Iterable[str]) -> np.ndarray:
+    """Signatures of several texts as a (len(texts), NUM_PERM) array."""
+    signatures = [minhash_signature(text) for text in texts]
+    return np.stack(signatures) if signatures else np.zeros((0, NUM_PERM), dtype=np.uint32)
+
+def lsh_bands(threshold: float, num_perm: int = NUM_PERM) -> Tuple[int, int]:
+    """Bands and rows per band for LSH at a given similarity threshold.
+
+    Two signatures become candidates if they agree on all rows of any band,
+    which happens with probability ``1 - (1 - s**rows)**bands`` at
+    similarity ``s``. Candidates are verified against the threshold
+    afterwards, so misses above it are weighted far more than false
+    candidates below it.
+    """
+    similarities = np.linspace(0.0, 1.0, 201)
+    best, best_cost = (num_perm, 1), None
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        probability = 1 - (1 - similarities ** rows) ** bands
+        missed = np.where(similarities >= threshold, 1 - probability, 0).mean()
+        extra = np.where(similarities < threshold, probability, 0).mean()
+        cost = 0.9 * missed + 0.1 * extra
+        if best_cost is None or cost < best_cost:
+            best, best_cost = (bands, rows), cost
+    return best
+
+def _band_hashes(signatures: np.ndarray, bands: int, rows: int) -> np.ndarray:
+    """One uint64 hash per LSH band of each signature, as a (len(signatures), bands) array."""
+    powers = np.uint64(0x100000001B3) ** np.arange(rows, dtype=np.uint64)
+    # uint64 arithmetic wraps around; a rare collision only adds a candidate that fails verification
+    return (signatures.reshape(len(signatures), bands, rows).astype(np.uint64) * powers).sum(axis=2, dtype=np.uint64)
+
+class NearDuplicateIndex:
+    """LSH index over the MinHash signatures of canonical chunks.
+
+    ``find`` returns the most similar indexed chunk whose estimated Jaccard
+    similarity reaches ``threshold``. Only canonical chunks are indexed;
+    their near-duplicates point at them instead of being indexed themselves.
+
+    Entries live in NumPy arrays: the chunk ID, the signature and one uint64
+    hash per band. Band lookups binary-search a sorted copy of each band's
+    hashes; entries added since it was last sorted are scanned directly,
+    and the copy is re-sorted once they make up an eighth of the index.
+    Removed entries are dropped when they outnumber live ones.
+    """
+
+    def __init__(self, threshold: Optional[float] = None, enabled: Optional[bool] = None):
+        if enabled is None:
+            enabled = os.getenv("NEAR_DUPLICATE_ENABLED", "true").lower() == "true"
+        self.enabled = enabled
+        self.threshold = threshold if threshold is not None else float(os.getenv("NEAR_DUPLICATE_THRESHOLD", "0.85"))
+        self.bands, self.rows = lsh_bands(self.threshold)
+        self._load(np.zeros(0, dtype=np.int64), np.zeros((0, NUM_PERM), dtype=np.uint32))
+
+    def _load(self, ids: np.ndarray, signatures: np.ndarray):
+        capacity = max(16, len(ids))
+        self._ids = np.zeros(capacity, dtype=np.int64)
+        self._alive = np.zeros(capacity, dtype=np.bool_)
+        self._signatures = np.zeros((capacity, NUM_PERM), dtype=np.uint32)
+        self._hashes = np.zeros((capacity, self.bands), dtype=np.uint64)
+        self._size = len(ids)
+        self._ids[:self._size] = ids
+        self._alive[:self._size] = True
+        self._signatures[:self._size] = signatures
+        self._hashes[:self._size] = _band_hashes(signatures, self.bands, self.rows)
+        self._live = self._size
+        self._sort()
+
+    def _sort(self):
+        # Per band: the hashes of all entries so far in order, and the entry each belongs to
+        hashes = self._hashes[:self._size].T
+        self._sorted_entries = np.argsort(hashes, axis=1, kind='stable').astype(np.int32)
+        self._sorted_hashes = np.take_along_axis(hashes, self._sorted_entries, axis=1)
+        self._sorted_size = self._size
+
+    def __len__(self) -> int:
+        return self._live
+
+    def memory_usage(self) -> int:
+        arrays = (self._ids, self._alive, self._signatures, self._hashes, self._sorted_entries, self._sorted_hashes)
+        return sum(array.nbytes for array in arrays)
+
+    def add(self, chunk_ids: Iterable[int], signatures: np.ndarray):
+        """Index canonical chunks with their signatures, one row of ``signatures`` per ID."""
+        chunk_ids = np.asarray(list(chunk_ids), dtype=np.int64)
+        if not self.enabled or not len(chunk_ids):
+            return
+        needed = self._size + len(chunk_ids)
+        if needed > len(self._ids):
+            capacity = max(needed, 2 * len(self._ids))
+            for name in ("_ids", "_alive", "_signatures", "_hashes"):
+                values = getattr(self, name)
+                grown = np.zeros((capacity, *values.shape[1:]), dtype=values.dtype)
+                grown[:self._size] = values[:self._size]
+                setattr(self, name, grown)
+        self._ids[self._size:needed] = chunk_ids
+        self._alive[self._size:needed] = True
+        self._signatures[self._size:needed] = signatures
+        self._hashes[self._size:needed] = _band_hashes(np.asarray(signatures, dtype=np.uint32), self.bands, self.rows)
+        self._size = needed
+        self._live += len(chunk_ids)
+        if self._size - self._sorted_size > max(64, self._sorted_size // 8):
+            self._sort()
+
+    def remove(self, chunk_ids: Iterable[int]):
+        chunk_ids = np.asarray(list(chunk_ids), dtype=np.int64)
+        if not len(chunk_ids) or not self._live:
+            return
+        removed = self._alive[:self._size] & np.isin(self._ids[:self._size], chunk_ids)
+        self._alive[:self._size][removed] = False
+        self._live -= int(removed.sum())
+        if self._size - self._live > max(self._live, 256):
+            keep = np.flatnonzero(self._alive[:self._size])
+            self._load(self._ids[keep], self._signatures[keep])
+
+    def find(self, signature: np.ndarray) -> Tuple[Optional[int], float]:
+        """The indexed chunk most similar to ``signature`` at or above the threshold, and its similarity."""
+        if not self._live:
+            return None, 0.0
+        hashes = _band_hashes(signature[None, :], self.bands, self.rows)[0]
+        candidates = [np.flatnonzero((self._hashes[self._sorted_size:self._size] == hashes).any(axis=1)) + self._sorted_size]
+        for band in range(self.bands):
+            lo = np.searchsorted(self._sorted_hashes[band], hashes[band], side='left')
+            hi = np.searchsorted(self._sorted_hashes[band], hashes[band], side='right')
+            candidates.append(self._sorted_entries[band, lo:hi])
+        entries = np.unique(np.concatenate(candidates))
+        entries = entries[self._alive[entries]]
+        if not len(entries):
+            return None, 0.0
+        similarities = (self._signatures[entries] == signature).mean(axis=1)
+        above = similarities >= self.threshold
+        if not above.any():
+            return None, 0.0
+        entries, similarities = entries[above], similarities[above]
+        # Most similar first, ties to the lowest chunk ID
+        best = np.lexsort((self._ids[entries], -similarities))[0]
+        return int(self._ids[entries[best]]), float(similarities[best])
+
+    def assign(self, signatures: np.ndarray, first_id: int) -> np.ndarray:
+        """Canonical chunk ID for each of a document's chunks, to be given IDs from ``first_id``.
+
+        A chunk near-duplicating an indexed chunk, or an earlier chunk of the
+        same document, maps to that chunk; any other chunk is its own
+        canonical. The index itself is not changed.
+        """
+        ids = np.arange(first_id, first_id + len(signatures), dtype=np.int64)
+        if not self.enabled:
+            return ids
+        # New canonicals go into a scratch index, so the document can dedupe against itself
+        pending = NearDuplicateIndex(self.threshold, enabled=True)
+        canonical_ids = ids.copy()
+        for i, signature in enumerate(signatures):
+            match, similarity = self.find(signature)
+            pending_match, pending_similarity = pending.find(signature)
+            if pending_match is not None and (match is None or pending_similarity > similarity):
+                match = pending_match
+            if match is None:
+                pending.add([ids[i]], signature[None, :])
+            else:
+                canonical_ids[i] = match
+        return canonical_ids
+
+    def snapshot(self) -> bytes:
+        """Serialize the IDs and signatures of the indexed chunks."""
+        keep = np.flatnonzero(self._alive[:self._size])
+        buffer = io.BytesIO()
+        np.savez(buffer, ids=self._ids[keep], signatures=self._signatures[keep])
+        return buffer.getvalue()
+
+    def restore(self, data: Optional[bytes], canonical_ids: np.ndarray, texts: Callable[[np.ndarray], Iterable[str]]):
+        """Index ``canonical_ids``, with the signatures in ``data`` (from ``snapshot``) where it has them.
+
+        Signatures it lacks, e.g. for stores written before they were
+        persisted, are computed from ``texts(ids)``.
+        """
+        if not self.enabled:
+            return
+        ids, signatures = np.zeros(0, dtype=np.int64), np.zeros((0, NUM_PERM), dtype=np.uint32)
+        if data is not None:
+            with np.load(io.BytesIO(data)) as saved:
+                ids, signatures = saved["ids"], saved["signatures"]
+            keep = np.isin(ids, canonical_ids)
+            ids, signatures = ids[keep], signatures[keep]
+        missing = canonical_ids[~np.isin(canonical_ids, ids)]
+        if len(missing):
+            ids = np.concatenate((ids, missing))
+            signatures = np.concatenate((signatures, minhash_signatures(texts(missing)).reshape(len(missing), NUM_PERM)))
+        self._load(ids, signatures)
@@ -0,0 +1,179 @@
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from models.chat import DocumentChunk
+
+logger = logging.getLogger(__name__)
+
+# Import the cross-encoder with error handling; without it reranking is skipped
+try:
+    from sentence_transformers import CrossEncoder
+    CROSS_ENCODER_AVAILABLE = True
+except ImportError as e:
+    logger.warning(f"Cross-encoder reranking disabled, sentence_transformers unavailable: {e}")
+    CROSS_ENCODER_AVAILABLE = False
+
+class Reranker:
+    """Second retrieval stage that re-scores a wide candidate set with a cross-encoder.
+
+    Candidates are scored in batches, in retrieval order, against a per-request
+    latency budget. Before each batch the expected batch time (from a moving
+    average of per-pair cost, seeded by a timed batch when the model loads)
+    is compared with the time left; a batch that does not fit is cut to the
+    pairs that do, and once none fit the remaining candidates keep their
+    retrieval order behind the scored ones. Scores are cached per
+    (query, chunk) so repeated questions cost nothing.
+    """
+
+    def __init__(
+        self,
+        model_name: Optional[str] = None,
+        enabled: Optional[bool] = None,
+        candidate_k: Optional[int] = None,
+        top_k: Optional[int] = None,
+        batch_size: Optional[int] = None,
+        budget_ms: Optional[float] = None,
+        min_score: Optional[float] = None,
+        cache_size: int = 10000,
+    ):
+        self.model_name = model_name or os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+        if enabled is None:
+            enabled = os.getenv("RERANK_ENABLED", "true").lower() in ("1", "true", "yes")
+        self.enabled = enabled and CROSS_ENCODER_AVAILABLE
+        self.candidate_k = candidate_k or int(os.getenv("RERANK_CANDIDATES", "20"))
+        self.top_k = top_k or int(os.getenv("RERANK_TOP_K", "5"))
+        self.batch_size = batch_size or int(os.getenv("RERANK_BATCH_SIZE", "16"))
+        self.budget_ms = budget_ms if budget_ms is not None else float(os.getenv("RERANK_BUDGET_MS", "150"))
+        if min_score is None and os.getenv("RERANK_MIN_SCORE"):
+            min_score = float(os.getenv("RERANK_MIN_SCORE"))
+        self.min_score = min_score
+
+        self._model = None
+        self._load_task: Optional[asyncio.Task] = None
+        self._cache: "OrderedDict[Tuple[str, str, str], float]" = OrderedDict()
+        self._cache_size = cache_size
+        # Moving average of the cost of scoring one (query, chunk) pair
+        self._seconds_per_pair = 0.0
+
+        self.requests = 0
+        self.skipped = 0
+        self.partial = 0
+        self.cache_hits = 0
+        self.pairs_scored = 0
+
+    async def _load_model(self):
+        try:
+            logger.info(f"Loading cross-encoder {self.model_name}...")
+            model = await asyncio.to_thread(CrossEncoder, self.model_name, device='cpu')
+            # Seed the per-pair cost, so the budget check holds from the first request
+            self._seconds_per_pair = await asyncio.to_thread(self._measure_pair_cost, model)
+            self._model = model
+            logger.info(f"Cross-encoder loaded ({self._seconds_per_pair * 1000:.1f} ms per pair)")
+        except Exception as e:
+            logger.error(f"Failed to load cross-encoder, reranking disabled: {e}")
+            self.enabled = False
+
+    def _measure_pair_cost(self, model) -> float:
+        """Seconds per pair for a full batch of chunk-sized inputs, after a warm-up call."""
+        pairs = [("how does the system answer questions", "retrieved context " * 60)] * self.batch_size
+        model.predict(pairs[:1])  # The first call pays one-off initialization
+        started = time.monotonic()
+        model.predict(pairs, batch_size=len(pairs))
+        return (time.monotonic() - started) / len(pairs)
+
+    def _model_ready(self) -> bool:
+        """Whether the model can be used now; starts loading it in the background if not."""
+        if self._model is not None:
+            return True
+        if self._load_task is None:
+            self._load_task = asyncio.create_task(self._load_model())
+        return False
+
+    def _cache_get(self, key: Tuple[str, str, str]) -> Optional[float]:
+        score = self._cache.get(key)
+        if score is not None:
+            self._cache.move_to_end(key)
+        return score
+
+    def _cache_put(self, key: Tuple[str, str, str], score: float):
+        self._cache[key] = score
+        self._cache.move_to_end(key)
+        while len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+
+    async def rerank(
+        self,
+        query: str,
+        candidates: List[DocumentChunk],
+        top_k: Optional[int] = None,
+        budget_ms: Optional[float] = None,
+    ) -> List[Tuple[DocumentChunk, Optional[float]]]:
+        """Return the best ``top_k`` candidates with their cross-encoder scores.
+
+        Candidates that could not be scored within the budget carry a score of
+        None and stay in their retrieval order after the scored ones.
+        """
+        top_k = top_k or self.top_k
+        budget_ms = self.budget_ms if budget_ms is None else budget_ms
+        deadline = time.monotonic() + budget_ms / 1000.0
+        self.requests += 1
+
+        # The model loads in the background; requests before that skip reranking
+        if not self.enabled or not candidates or not self._model_ready():
+            self.skipped += 1
+            return [(chunk, None) for chunk in candidates[:top_k]]
+
+        keys = [(query, chunk.document_id, chunk.id) for chunk in candidates]
+        scores: List[Optional[float]] = [self._cache_get(key) for key in keys]
+        self.cache_hits += sum(score is not None for score in scores)
+        pending = [i for i, score in enumerate(scores) if score is None]
+
+        start = 0
+        while start < len(pending):
+            batch = pending[start:start + self.batch_size]
+            remaining = deadline - time.monotonic()
+            if self._seconds_per_pair * len(batch) > remaining:
+                # Score what still fits in the budget, then stop
+                batch = batch[:int(remaining / self._seconds_per_pair)] if remaining > 0 else []
+                if not batch:
+                    self.partial += 1
+                    logger.info(f"Rerank budget exhausted after {start}/{len(pending)} candidates")
+                    break
+            start += len(batch)
+
+            batch_start = time.monotonic()
+            pairs = [(query, candidates[i].content) for i in batch]
+            batch_scores = await asyncio.to_thread(self._model.predict, pairs, batch_size=len(pairs))
+            elapsed = time.monotonic() - batch_start
+
+            per_pair = elapsed / len(batch)
+            self._seconds_per_pair = per_pair if not self._seconds_per_pair else 0.8 * self._seconds_per_pair + 0.2 * per_pair
+            self.pairs_scored += len(batch)
+
+            for i, score in zip(batch, batch_scores):
+                scores[i] = float(score)
+                self._cache_put(keys[i], scores[i])
+
+        scored = [(candidates[i], scores[i]) for i in range(len(candidates)) if scores[i] is not None]
+        unscored = [(candidates[i], None) for i in range(len(candidates)) if scores[i] is None]
+        scored.sort(key=lambda item: item[1], reverse=True)
+        if self.min_score is not None:
+            scored = [item for item in scored if item[1] >= self.min_score]
+
+        return (scored + unscored)[:top_k]
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "model_loaded": self._model is not None,
+            "requests": self.requests,
+            "skipped": self.skipped,
+            "partial": self.partial,
+            "cache_hits": self.cache_hits,
+            "pairs_scored": self.pairs_scored,
+            "ms_per_pair": round(self._seconds_per_pair * 1000, 3),
+        }
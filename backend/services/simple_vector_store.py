@@ -1,65 +1,242 @@
 import os
+import copy
 import json
 import uuid
-from typing import List, Dict, Any
+import asyncio
+from datetime import datetime, timezone
+from typing import List, Dict, Any, Optional, Tuple
 import logging
+import numpy as np
 from models.chat import DocumentChunk, Source
+from services.chunk_table import ChunkTable
+from services.document_catalog import DocumentCatalog, decode_cursor
+from services.near_duplicate import NearDuplicateIndex, minhash_signatures
+from services.write_ahead_log import WriteAheadLog, atomic_write
 
 logger = logging.getLogger(__name__)
 
 class SimpleVectorStore:
-    """A simple in-memory vector store for testing purposes."""
+    """A simple in-memory vector store for testing purposes.
     
-    def __init__(self):
+    Chunks live in a columnar ``ChunkTable``. Mutations are persisted through
+    a write-ahead log in ``data_dir`` before they are applied, and the log is
+    periodically compacted into a snapshot of the whole store, built off the
+    event loop from the previous snapshot and the log. Near-duplicate chunks are detected at
+    ingest and searched through their canonical chunk only.
+    """
+    
+    def __init__(self, data_dir: str = "."):
         logger.info("Initializing SimpleVectorStore...")
-        self.documents: Dict[str, DocumentChunk] = {}
-        self.doc_metadata: Dict[str, Dict] = {}
-        self.metadata_file = "simple_documents_metadata.json"
+        self._init_state()
+        self.data_dir = data_dir
+        # Pre-WAL layout, still read when no snapshot exists yet
+        self.metadata_file = os.path.join(data_dir, "simple_documents_metadata.json")
+        self.chunks_file = os.path.join(data_dir, "simple_documents_chunks.json")
+        self.wal = WriteAheadLog(data_dir)
+        # Mutations are planned, logged and applied one at a time, so each is
+        # applied only once durable and is planned against the state it applies to
+        self._mutation_lock = asyncio.Lock()
         
         self._load_existing_data()
         logger.info("SimpleVectorStore initialization complete")
     
+    def _init_state(self):
+        self.chunks = ChunkTable()
+        self.catalog = DocumentCatalog()
+        self.near_duplicates = NearDuplicateIndex()
+    
     def _load_existing_data(self):
-        """Load existing metadata if available."""
-        if os.path.exists(self.metadata_file):
-            try:
-                with open(self.metadata_file, 'r') as f:
-                    self.doc_metadata = json.load(f)
-                logger.info(f"Loaded {len(self.doc_metadata)} document metadata records")
-            except Exception as e:
-                logger.error(f"Failed to load metadata: {e}")
-                self.doc_metadata = {}
-    
-    def _save_metadata(self):
-        """Save metadata to file."""
+        """Load the latest snapshot (or legacy files) and replay the log on top."""
+        self._load_snapshot(self.wal.snapshot_generation)
+        
+        replayed = 0
+        for record in self.wal.replay():
+            self._apply(record)
+            replayed += 1
+        logger.info(f"Loaded {len(self.catalog)} documents and {len(self.chunks)} chunks ({replayed} log records replayed)")
+    
+    def _load_snapshot(self, generation: Optional[int]):
+        """Load the snapshot of ``generation``, or the legacy files if there is none."""
+        if generation is not None and os.path.exists(self.wal.snapshot_path("chunks.npz", generation)):
+            with open(self.wal.snapshot_path("catalog.json", generation), 'r') as f:
+                self.catalog = DocumentCatalog.from_entries(json.load(f).values())
+            with open(self.wal.snapshot_path("chunks.npz", generation), 'rb') as columns, open(self.wal.snapshot_path("text.bin", generation), 'rb') as text:
+                self.chunks = ChunkTable.from_snapshot(columns.read(), text.read())
+        else:
+            self._load_legacy_files(generation)
+        # Snapshots keep the signatures of canonical chunks; any missing are computed from the text
+        signatures = None
+        if generation is not None and os.path.exists(self.wal.snapshot_path("minhash.npz", generation)):
+            with open(self.wal.snapshot_path("minhash.npz", generation), 'rb') as f:
+                signatures = f.read()
+        self.near_duplicates.restore(signatures, self.chunks.canonical_ids(), self.chunks.texts)
+    
+    def _load_legacy_files(self, generation: Optional[int]):
+        """Load stores written before the columnar layout (one JSON object per chunk)."""
+        catalog_entries, chunk_dicts = [], []
         try:
-            with open(self.metadata_file, 'w') as f:
-                json.dump(self.doc_metadata, f, indent=2)
+            if generation is not None:
+                with open(self.wal.snapshot_path("store.json", generation), 'r') as f:
+                    data = json.load(f)
+                catalog_entries, chunk_dicts = list(data["catalog"].values()), data["chunks"]
+            else:
+                if os.path.exists(self.metadata_file):
+                    with open(self.metadata_file, 'r') as f:
+                        catalog_entries = list(json.load(f).values())
+                if os.path.exists(self.chunks_file):
+                    with open(self.chunks_file, 'r') as f:
+                        chunk_dicts = json.load(f)
         except Exception as e:
-            logger.error(f"Failed to save metadata: {e}")
+            logger.error(f"Failed to load metadata: {e}")
+            return
+        
+        self.catalog = DocumentCatalog.from_entries(catalog_entries)
+        by_document: Dict[str, List[DocumentChunk]] = {}
+        for chunk_data in chunk_dicts:
+            chunk = DocumentChunk(**chunk_data)
+            by_document.setdefault(chunk.document_id, []).append(chunk)
+        for doc_id, chunks in by_document.items():
+            self.chunks.append_document(doc_id, chunks[0].metadata.get("source", "Unknown"), chunks)
+        self.catalog.reset_chunk_ranges(self.chunks.iter_doc_ids())
+    
+    def _apply(self, record: Dict[str, Any]):
+        """Apply a logged mutation. Safe to repeat for an already applied record."""
+        if record["op"] == "add":
+            if record["doc_id"] not in self.catalog:
+                chunks = [
+                    DocumentChunk(**{"id": "", "document_id": record["doc_id"], **chunk_data})
+                    for chunk_data in record["chunks"]
+                ]
+                self._apply_add(
+                    record["doc_id"], record["filename"], chunks,
+                    record["created_at"], record.get("first_chunk_id"),
+                    record.get("duplicate_of")
+                )
+        elif record["op"] == "delete":
+            self._apply_delete(record["doc_id"])
+    
+    def _apply_add(
+        self,
+        doc_id: str,
+        filename: str,
+        chunks: List[DocumentChunk],
+        created_at: Optional[str] = None,
+        first_chunk_id: Optional[int] = None,
+        duplicate_of: Optional[List[Optional[int]]] = None,
+        signatures: Optional[np.ndarray] = None
+    ) -> Dict[str, Any]:
+        """Append a document; ``duplicate_of`` gives each chunk's canonical chunk ID, or None for itself."""
+        source = chunks[0].metadata.get("source", filename) if chunks else filename
+        first_chunk_id = self.chunks.first_id_for(first_chunk_id)
+        duplicate_of = duplicate_of or [None] * len(chunks)
+        canonical_ids = np.array([
+            first_chunk_id + i if canonical is None else canonical for i, canonical in enumerate(duplicate_of)
+        ], dtype=np.int64)
+        self.chunks.append_document(doc_id, source, chunks, first_chunk_id, canonical_ids)
+        canonical = [i for i, target in enumerate(duplicate_of) if target is None]
+        self._index_signatures([first_chunk_id + i for i in canonical], None if signatures is None else signatures[canonical])
+        return self.catalog.add(doc_id, filename, chunks, first_chunk_id, created_at, len(chunks) - len(canonical))
+    
+    def _apply_delete(self, doc_id: str) -> bool:
+        entry = self.catalog.remove(doc_id)
+        if entry is None:
+            return False
+        
+        # A document's chunks have consecutive IDs; duplicates of its chunks
+        # in other documents take over as canonical
+        first, last = entry["first_chunk_seq"], entry["last_chunk_seq"]
+        self.near_duplicates.remove(self.chunks.canonical_ids_in_range(first, last))
+        promoted = [promoted for _, promoted in self.chunks.promote_duplicates(first, last)]
+        self._index_signatures(promoted)
+        self.catalog.count_promoted(self.chunks.doc_id(row) for row in self.chunks.rows_for_ids(promoted).tolist())
+        self.chunks.delete_range(first, last)
+        return True
+    
+    def _index_signatures(self, chunk_ids: List[int], signatures: Optional[np.ndarray] = None):
+        """Add canonical chunks to the near-duplicate index, computing their signatures if not given."""
+        if not chunk_ids or not self.near_duplicates.enabled:
+            return
+        if signatures is None:
+            signatures = minhash_signatures(self.chunks.texts(chunk_ids))
+        self.near_duplicates.add(chunk_ids, signatures)
+    
+    def _build_snapshot(self, base_generation: Optional[int], generation: int) -> int:
+        """Write the snapshot for ``generation``: the base snapshot plus the log before it.
+        
+        Runs in a worker thread on a private copy of the store, so it never
+        reads live state and the event loop is not blocked however large the
+        store is.
+        """
+        builder = copy.copy(self)
+        builder._init_state()
+        builder._load_snapshot(base_generation)
+        for record in self.wal.records(base_generation or 0, generation):
+            builder._apply(record)
+        
+        columns, text = builder.chunks.snapshot()
+        catalog_data = json.dumps(builder.catalog.to_dict()).encode('utf-8')
+        signatures = builder.near_duplicates.snapshot()
+        atomic_write(self.wal.snapshot_path("chunks.npz", generation), columns)
+        atomic_write(self.wal.snapshot_path("text.bin", generation), text)
+        atomic_write(self.wal.snapshot_path("catalog.json", generation), catalog_data)
+        atomic_write(self.wal.snapshot_path("minhash.npz", generation), signatures)
+        return len(columns) + len(text) + len(catalog_data) + len(signatures)
+    
+    async def _log(self, record: Dict[str, Any]):
+        await self.wal.append(record)
+        self.wal.maybe_compact(self._build_snapshot)
+    
+    async def close(self):
+        """Flush the write-ahead log before the store is dropped from memory."""
+        await self.wal.close()
+    
+    def memory_usage(self) -> int:
+        """Approximate number of bytes held in memory by this store."""
+        return self.chunks.memory_usage() + self.near_duplicates.memory_usage()
+    
+    def stats(self) -> Dict[str, Any]:
+        duplicates = self.chunks.duplicate_count()
+        return {
+            "documents": len(self.catalog),
+            "chunks": len(self.chunks),
+            "canonical_chunks": len(self.chunks) - duplicates,
+            "duplicate_chunks": duplicates,
+            "near_duplicate_threshold": self.near_duplicates.threshold if self.near_duplicates.enabled else None,
+        }
     
     async def add_document(self, filename: str, chunks: List[DocumentChunk]) -> str:
         """Add a document and its chunks to the store."""
         doc_id = str(uuid.uuid4())
         
-        # Store document chunks
-        for i, chunk in enumerate(chunks):
-            # Update the chunk with document_id
-            chunk.document_id = doc_id
-            chunk_id = chunk.id
-            self.documents[chunk_id] = chunk
-        
-        # Store document metadata
-        self.doc_metadata[doc_id] = {
-            "filename": filename,
-            "chunk_count": len(chunks),
-            "doc_id": doc_id
-        }
+        async with self._mutation_lock:
+            # Map near-duplicates of stored chunks (or of earlier chunks of this document) to those
+            signatures = minhash_signatures(chunk.content for chunk in chunks)
+            first_chunk_id = self.chunks.first_id_for()
+            canonical_ids = self.near_duplicates.assign(signatures, first_chunk_id)
+            duplicate_of = [
+                None if canonical == first_chunk_id + i else canonical for i, canonical in enumerate(canonical_ids.tolist())
+            ]
+            created_at = datetime.now(timezone.utc).isoformat()
+            
+            # Logged first: if the append fails the store is left unchanged
+            await self._log({
+                "op": "add",
+                "doc_id": doc_id,
+                "filename": filename,
+                "created_at": created_at,
+                "first_chunk_id": first_chunk_id,
+                "chunks": [{"content": chunk.content, "metadata": chunk.metadata} for chunk in chunks],
+                "duplicate_of": duplicate_of
+            })
+            entry = self._apply_add(doc_id, filename, chunks, created_at, first_chunk_id, duplicate_of, signatures)
         
-        self._save_metadata()
-        logger.info(f"Added document {filename} with {len(chunks)} chunks")
+        logger.info(f"Added document {filename} with {len(chunks)} chunks ({entry['duplicate_chunks']} near-duplicates)")
         return doc_id
     
+    def get_document(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        """The listing entry of one document, or None if it does not exist."""
+        return self.catalog.describe(doc_id)
+    
     async def search(self, query: str, k: int = 5) -> List[DocumentChunk]:
         """Simple keyword search (for testing - not semantic)."""
         try:
@@ -70,50 +247,43 @@ class SimpleVectorStore:
             
             print(f"Searching for words: {query_words}")
             
-            results = []
-            
-            for chunk in self.documents.values():
-                content_lower = chunk.content.lower()
-                # Count matches for each query word
-                matches = sum(1 for word in query_words if word in content_lower)
-                
-                # If at least one word matches, include it
-                if matches > 0:
-                    results.append((chunk, matches))
+            # Count, for every chunk containing at least one query word, how many it contains
+            rows, matches = self.chunks.match_counts(query_words)
             
-            # Sort by number of matches (descending)
-            results.sort(key=lambda x: x[1], reverse=True)
+            # Sort by number of matches (descending), ties in insertion order
+            order = np.argsort(-matches, kind='stable')
             
-            print(f"Found {len(results)} results")
+            print(f"Found {len(rows)} results")
             
-            # Return up to k results (just the chunks, not the scores)
-            return [chunk for chunk, _ in results[:k]]
+            # Return up to k results (just the chunks, not the scores), each
+            # naming the other documents that contain a near-duplicate of it
+            results = self.chunks.chunks(rows[order[:k]])
+            duplicate_sources = self.chunks.duplicate_sources(int(chunk.id) for chunk in results)
+            for chunk in results:
+                if int(chunk.id) in duplicate_sources:
+                    chunk.metadata["duplicate_sources"] = duplicate_sources[int(chunk.id)]
+            return results
             
         except Exception as e:
             print(f"Search error: {e}")
             return []
     
-    async def list_documents(self) -> List[Dict[str, Any]]:
-        """List all documents in the store."""
-        return list(self.doc_metadata.values())
+    async def list_documents(self, cursor: Optional[str] = None, limit: int = 100) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """List one page of documents in the store and the cursor of the next page."""
+        return self.catalog.page(cursor, limit)
+    
+    async def list_chunks(self, cursor: Optional[str] = None, limit: int = 100) -> Tuple[List[DocumentChunk], Optional[str]]:
+        """List one page of chunks in insertion order and the cursor of the next page."""
+        rows, next_id = self.chunks.page(decode_cursor(cursor), limit)
+        return self.chunks.chunks(rows), str(next_id) if next_id is not None else None
     
     async def delete_document(self, doc_id: str) -> bool:
         """Delete a document and all its chunks."""
-        if doc_id not in self.doc_metadata:
-            return False
-        
-        # Remove all chunks for this document
-        chunks_to_remove = [
-            chunk_id for chunk_id, chunk in self.documents.items()
-            if chunk.document_id == doc_id
-        ]
-        
-        for chunk_id in chunks_to_remove:
-            del self.documents[chunk_id]
-        
-        # Remove metadata
-        del self.doc_metadata[doc_id]
-        self._save_metadata()
+        async with self._mutation_lock:
+            if doc_id not in self.catalog:
+                return False
+            await self._log({"op": "delete", "doc_id": doc_id})
+            self._apply_delete(doc_id)
         
         logger.info(f"Deleted document {doc_id}")
         return True
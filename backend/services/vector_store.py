@@ -1,9 +1,14 @@
 import os
+import copy
 import json
+import time
 import uuid
+import asyncio
+import base64
 import faiss
 import numpy as np
-from typing import List, Dict, Any
+from datetime import datetime, timezone
+from typing import List, Dict, Any, Optional, Tuple
 import logging
 
 # Set up logging
@@ -19,11 +24,25 @@ except ImportError as e:
     SENTENCE_TRANSFORMERS_AVAILABLE = False
 
 from models.chat import DocumentChunk, Source
+from services.chunk_table import ChunkTable
+from services.document_catalog import DocumentCatalog, decode_cursor
+from services.near_duplicate import NearDuplicateIndex, minhash_signatures
+from services.write_ahead_log import WriteAheadLog, atomic_write
 
 class VectorStore:
-    """Manages document embeddings and vector search using FAISS."""
+    """Manages document embeddings and vector search using FAISS.
     
-    def __init__(self):
+    Chunks live in a columnar ``ChunkTable`` and their vectors are stored in
+    the FAISS index under the chunk IDs, so search hits map straight back to
+    table rows and deleting a document removes exactly its ID range.
+    A chunk that near-duplicates a stored one is not embedded: it points at
+    that canonical chunk, whose single vector represents every document
+    containing the passage. Mutations are logged before they are applied,
+    and snapshots are built off the event loop from the previous snapshot
+    and the log.
+    """
+    
+    def __init__(self, data_dir: str = "."):
         logger.info("Initializing VectorStore...")
         
         if not SENTENCE_TRANSFORMERS_AVAILABLE:
@@ -39,76 +58,257 @@ class VectorStore:
             raise
             
         self.dimension = 384  # all-MiniLM-L6-v2 embedding dimension
-        self.index = faiss.IndexFlatL2(self.dimension)
-        self.documents: Dict[str, DocumentChunk] = {}
-        self.doc_metadata: Dict[str, Dict] = {}
-        self.index_file = "vector_index.faiss"
-        self.metadata_file = "documents_metadata.json"
+        self._init_state()
+        # Embedding work done, and skipped thanks to near-duplicates, since load
+        self.embedding_seconds = 0.0
+        self.embedded_chunks = 0
+        self.skipped_embeddings = 0
+        self.data_dir = data_dir
+        # Pre-WAL layout, still read when no snapshot exists yet
+        self.index_file = os.path.join(data_dir, "vector_index.faiss")
+        self.metadata_file = os.path.join(data_dir, "documents_metadata.json")
+        self.wal = WriteAheadLog(data_dir)
+        # Mutations are planned, logged and applied one at a time, so each is
+        # applied only once durable and is planned against the state it applies to
+        self._mutation_lock = asyncio.Lock()
         
         logger.info("Loading existing data...")
         self._load_existing_data()
         logger.info("VectorStore initialization complete")
     
+    def _init_state(self):
+        self.index = faiss.IndexIDMap2(faiss.IndexFlatL2(self.dimension))
+        self.chunks = ChunkTable()
+        self.catalog = DocumentCatalog()
+        self.near_duplicates = NearDuplicateIndex()
+    
     def _load_existing_data(self):
-        """Load existing index and metadata if available."""
-        if os.path.exists(self.index_file):
-            self.index = faiss.read_index(self.index_file)
+        """Load the latest snapshot (or legacy files) and replay the log on top."""
+        self._load_snapshot(self.wal.snapshot_generation)
+        for record in self.wal.replay():
+            self._apply(record)
+    
+    def _load_snapshot(self, generation: Optional[int]):
+        """Load the snapshot of ``generation``, or the legacy files if there is none."""
+        if generation is not None and os.path.exists(self.wal.snapshot_path("chunks.npz", generation)):
+            self.index = faiss.read_index(self.wal.snapshot_path("index.faiss", generation))
+            with open(self.wal.snapshot_path("catalog.json", generation), 'r') as f:
+                self.catalog = DocumentCatalog.from_entries(json.load(f).values())
+            with open(self.wal.snapshot_path("chunks.npz", generation), 'rb') as columns, open(self.wal.snapshot_path("text.bin", generation), 'rb') as text:
+                self.chunks = ChunkTable.from_snapshot(columns.read(), text.read())
+        else:
+            self._load_legacy_files(generation)
+        # Snapshots keep the signatures of canonical chunks; any missing are computed from the text
+        signatures = None
+        if generation is not None and os.path.exists(self.wal.snapshot_path("minhash.npz", generation)):
+            with open(self.wal.snapshot_path("minhash.npz", generation), 'rb') as f:
+                signatures = f.read()
+        self.near_duplicates.restore(signatures, self.chunks.canonical_ids(), self.chunks.texts)
+    
+    def _apply(self, record: Dict[str, Any]):
+        """Apply a logged mutation. Safe to repeat for an already applied record."""
+        # Logged adds carry their embeddings, so replay never re-encodes text
+        if record["op"] == "add":
+            if record["doc_id"] not in self.catalog:
+                chunks = [
+                    DocumentChunk(**{"id": "", "document_id": record["doc_id"], **chunk_data})
+                    for chunk_data in record["chunks"]
+                ]
+                embeddings = np.frombuffer(base64.b64decode(record["embeddings"]), dtype='float32')
+                self._apply_add(
+                    record["doc_id"], record["filename"], chunks,
+                    embeddings.reshape(-1, self.dimension),
+                    record["created_at"], record.get("first_chunk_id"),
+                    record.get("duplicate_of")
+                )
+        elif record["op"] == "delete":
+            self._apply_delete(record["doc_id"])
+    
+    def _load_legacy_files(self, generation: Optional[int]):
+        """Load stores written before the columnar layout.
         
-        if os.path.exists(self.metadata_file):
-            with open(self.metadata_file, 'r') as f:
-                data = json.load(f)
-                self.doc_metadata = data.get('metadata', {})
-                # Reconstruct documents dict from metadata
-                for doc_id, metadata in self.doc_metadata.items():
-                    chunk = DocumentChunk(
-                        text=metadata['text'],
-                        metadata=metadata['metadata'],
-                        chunk_id=metadata['chunk_id']
-                    )
-                    self.documents[doc_id] = chunk
-    
-    def _save_data(self):
-        """Save index and metadata to disk."""
-        faiss.write_index(self.index, self.index_file)
+        Those kept one JSON object per chunk and a plain positional FAISS
+        index; the vectors are read back out of it and re-added by chunk ID.
+        """
+        if generation is not None:
+            index_file = self.wal.snapshot_path("index.faiss", generation)
+            metadata_file = self.wal.snapshot_path("metadata.json", generation)
+        else:
+            index_file, metadata_file = self.index_file, self.metadata_file
+        if not os.path.exists(metadata_file):
+            return
         
-        # Convert documents to serializable format
-        serializable_metadata = {}
-        for doc_id, chunk in self.documents.items():
-            serializable_metadata[doc_id] = {
-                'text': chunk.text,
-                'metadata': chunk.metadata,
-                'chunk_id': chunk.chunk_id
-            }
+        with open(metadata_file, 'r') as f:
+            data = json.load(f)
+        self.catalog = DocumentCatalog.from_entries(data.get('metadata', {}).values())
         
-        with open(self.metadata_file, 'w') as f:
-            json.dump({'metadata': serializable_metadata}, f)
+        # Chunks were stored in index order and each document's chunks are contiguous
+        chunk_dicts = list(data.get('chunks', {}).values())
+        vectors = np.zeros((0, self.dimension), dtype='float32')
+        if os.path.exists(index_file):
+            legacy_index = faiss.read_index(index_file)
+            vectors = legacy_index.reconstruct_n(0, legacy_index.ntotal)
+        start = 0
+        while start < len(chunk_dicts):
+            doc_id = chunk_dicts[start]['document_id']
+            end = start
+            while end < len(chunk_dicts) and chunk_dicts[end]['document_id'] == doc_id:
+                end += 1
+            chunks = [DocumentChunk(**chunk_data) for chunk_data in chunk_dicts[start:end]]
+            filename = chunks[0].metadata.get('document_name', 'Unknown')
+            first_id, last_id = self.chunks.append_document(doc_id, filename, chunks)
+            self.index.add_with_ids(vectors[start:end], np.arange(first_id, last_id + 1, dtype='int64'))
+            start = end
+        self.catalog.reset_chunk_ranges(self.chunks.iter_doc_ids())
     
-    async def add_document(self, filename: str, chunks: List[DocumentChunk]) -> str:
-        """Add document chunks to the vector store."""
-        doc_id = str(uuid.uuid4())
+    def _apply_add(
+        self,
+        doc_id: str,
+        filename: str,
+        chunks: List[DocumentChunk],
+        embeddings: np.ndarray,
+        created_at: Optional[str] = None,
+        first_chunk_id: Optional[int] = None,
+        duplicate_of: Optional[List[Optional[int]]] = None,
+        signatures: Optional[np.ndarray] = None
+    ) -> Dict[str, Any]:
+        """Append a document; ``duplicate_of`` gives each chunk's canonical chunk ID, or None for itself.
         
-        # Generate embeddings for all chunks
-        texts = [chunk.text for chunk in chunks]
-        embeddings = self.model.encode(texts)
+        ``embeddings`` holds one vector per canonical chunk, in chunk order.
+        """
+        # The chunk table hands out the IDs the vectors are stored under
+        first_chunk_id = self.chunks.first_id_for(first_chunk_id)
+        duplicate_of = duplicate_of or [None] * len(chunks)
+        canonical = [i for i, target in enumerate(duplicate_of) if target is None]
+        canonical_ids = np.array([
+            first_chunk_id + i if target is None else target for i, target in enumerate(duplicate_of)
+        ], dtype=np.int64)
+        self.chunks.append_document(doc_id, filename, chunks, first_chunk_id, canonical_ids)
+        self.index.add_with_ids(embeddings, np.array([first_chunk_id + i for i in canonical], dtype='int64'))
+        self._index_signatures([first_chunk_id + i for i in canonical], None if signatures is None else signatures[canonical])
+        return self.catalog.add(doc_id, filename, chunks, first_chunk_id, created_at, len(chunks) - len(canonical))
+    
+    def _apply_delete(self, doc_id: str) -> bool:
+        entry = self.catalog.remove(doc_id)
+        if entry is None:
+            return False
+        
+        # A document's chunks have consecutive IDs; duplicates of its chunks
+        # in other documents take over as canonical, keeping the vector
+        first, last = entry["first_chunk_seq"], entry["last_chunk_seq"]
+        self.near_duplicates.remove(self.chunks.canonical_ids_in_range(first, last))
+        promotions = self.chunks.promote_duplicates(first, last)
+        for previous, promoted in promotions:
+            self.index.add_with_ids(self.index.reconstruct(previous).reshape(1, -1), np.array([promoted], dtype='int64'))
+        promoted = [promoted for _, promoted in promotions]
+        self._index_signatures(promoted)
+        self.catalog.count_promoted(self.chunks.doc_id(row) for row in self.chunks.rows_for_ids(promoted).tolist())
+        self.chunks.delete_range(first, last)
+        if last >= first:
+            self.index.remove_ids(np.arange(first, last + 1, dtype='int64'))
+        return True
+    
+    def _index_signatures(self, chunk_ids: List[int], signatures: Optional[np.ndarray] = None):
+        """Add canonical chunks to the near-duplicate index, computing their signatures if not given."""
+        if not chunk_ids or not self.near_duplicates.enabled:
+            return
+        if signatures is None:
+            signatures = minhash_signatures(self.chunks.texts(chunk_ids))
+        self.near_duplicates.add(chunk_ids, signatures)
+    
+    def _build_snapshot(self, base_generation: Optional[int], generation: int) -> int:
+        """Write the snapshot for ``generation``: the base snapshot plus the log before it.
         
-        # Add embeddings to FAISS index
-        self.index.add(embeddings.astype('float32'))
+        Runs in a worker thread on a private copy of the store, so it never
+        reads live state and the event loop is not blocked however large the
+        store is. Logged embeddings are reused; nothing is re-encoded.
+        """
+        builder = copy.copy(self)
+        builder._init_state()
+        builder._load_snapshot(base_generation)
+        for record in self.wal.records(base_generation or 0, generation):
+            builder._apply(record)
         
-        # Store chunk metadata
-        for i, chunk in enumerate(chunks):
-            chunk_doc_id = f"{doc_id}_{i}"
-            chunk.metadata['document_id'] = doc_id
-            chunk.metadata['document_name'] = filename
-            self.documents[chunk_doc_id] = chunk
-            self.doc_metadata[chunk_doc_id] = {
-                'document_id': doc_id,
-                'document_name': filename,
-                'chunk_index': i
-            }
+        index_data = faiss.serialize_index(builder.index).tobytes()
+        columns, text = builder.chunks.snapshot()
+        catalog_data = json.dumps(builder.catalog.to_dict()).encode('utf-8')
+        signatures = builder.near_duplicates.snapshot()
+        atomic_write(self.wal.snapshot_path("index.faiss", generation), index_data)
+        atomic_write(self.wal.snapshot_path("chunks.npz", generation), columns)
+        atomic_write(self.wal.snapshot_path("text.bin", generation), text)
+        atomic_write(self.wal.snapshot_path("catalog.json", generation), catalog_data)
+        atomic_write(self.wal.snapshot_path("minhash.npz", generation), signatures)
+        return len(index_data) + len(columns) + len(text) + len(catalog_data) + len(signatures)
+    
+    async def _log(self, record: Dict[str, Any]):
+        await self.wal.append(record)
+        self.wal.maybe_compact(self._build_snapshot)
+    
+    async def close(self):
+        """Flush the write-ahead log before the store is dropped from memory."""
+        await self.wal.close()
+    
+    def memory_usage(self) -> int:
+        """Approximate number of bytes held in memory by this store."""
+        # Vectors plus the ID map entry for each of them
+        index_bytes = self.index.ntotal * (self.dimension * 4 + 16)
+        return index_bytes + self.chunks.memory_usage() + self.near_duplicates.memory_usage()
+    
+    def stats(self) -> Dict[str, Any]:
+        duplicates = self.chunks.duplicate_count()
+        seconds_per_chunk = self.embedding_seconds / self.embedded_chunks if self.embedded_chunks else 0.0
+        return {
+            "documents": len(self.catalog),
+            "chunks": len(self.chunks),
+            "canonical_chunks": len(self.chunks) - duplicates,
+            "duplicate_chunks": duplicates,
+            "near_duplicate_threshold": self.near_duplicates.threshold if self.near_duplicates.enabled else None,
+            "vectors": self.index.ntotal,
+            "index_bytes_saved": duplicates * (self.dimension * 4 + 16),
+            "embedding_seconds": round(self.embedding_seconds, 3),
+            # Estimated from the average time per embedded chunk
+            "embedding_seconds_saved": round(self.skipped_embeddings * seconds_per_chunk, 3),
+        }
+    
+    async def add_document(self, filename: str, chunks: List[DocumentChunk]) -> str:
+        """Add document chunks to the vector store."""
+        doc_id = str(uuid.uuid4())
         
-        self._save_data()
+        async with self._mutation_lock:
+            # Map near-duplicates of stored chunks (or of earlier chunks of this
+            # document) to those, and embed only the remaining canonical chunks
+            signatures = minhash_signatures(chunk.content for chunk in chunks)
+            first_chunk_id = self.chunks.first_id_for()
+            canonical_ids = self.near_duplicates.assign(signatures, first_chunk_id)
+            duplicate_of = [
+                None if canonical == first_chunk_id + i else canonical for i, canonical in enumerate(canonical_ids.tolist())
+            ]
+            texts = [chunk.content for chunk, target in zip(chunks, duplicate_of) if target is None]
+            started = time.perf_counter()
+            embeddings = self.model.encode(texts).astype('float32').reshape(len(texts), self.dimension)
+            self.embedding_seconds += time.perf_counter() - started
+            self.embedded_chunks += len(texts)
+            self.skipped_embeddings += len(chunks) - len(texts)
+            created_at = datetime.now(timezone.utc).isoformat()
+            
+            # Logged first: if the append fails the store is left unchanged
+            await self._log({
+                'op': 'add',
+                'doc_id': doc_id,
+                'filename': filename,
+                'created_at': created_at,
+                'first_chunk_id': first_chunk_id,
+                'chunks': [{'content': chunk.content, 'metadata': chunk.metadata} for chunk in chunks],
+                'embeddings': base64.b64encode(embeddings.tobytes()).decode('ascii'),
+                'duplicate_of': duplicate_of
+            })
+            self._apply_add(doc_id, filename, chunks, embeddings, created_at, first_chunk_id, duplicate_of, signatures)
         return doc_id
     
+    def get_document(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        """The listing entry of one document, or None if it does not exist."""
+        return self.catalog.describe(doc_id)
+    
     async def search(self, query: str, k: int = 5) -> List[Source]:
         """Search for relevant document chunks."""
         if self.index.ntotal == 0:
@@ -117,79 +317,40 @@ class VectorStore:
         # Generate query embedding
         query_embedding = self.model.encode([query])
         
-        # Search in FAISS index
-        scores, indices = self.index.search(query_embedding.astype('float32'), k)
+        # Search in FAISS index; hits come back as chunk IDs
+        scores, ids = self.index.search(query_embedding.astype('float32'), k)
+        rows = self.chunks.rows_for_ids(ids[0])
+        duplicate_sources = self.chunks.duplicate_sources(ids[0][rows != -1])
         
         sources = []
-        for i, (score, idx) in enumerate(zip(scores[0], indices[0])):
-            if idx == -1:  # No more results
-                break
-                
-            # Find corresponding document chunk
-            chunk_keys = list(self.documents.keys())
-            if idx < len(chunk_keys):
-                chunk_key = chunk_keys[idx]
-                chunk = self.documents[chunk_key]
-                
-                source = Source(
-                    document_name=chunk.metadata.get('document_name', 'Unknown'),
-                    chunk_text=chunk.text,
-                    score=float(score)
-                )
-                sources.append(source)
+        for score, chunk_id, row in zip(scores[0], ids[0], rows):
+            if row == -1:  # No more results
+                continue
+            
+            source = Source(
+                document_name=self.catalog.get(self.chunks.doc_id(row))['filename'],
+                chunk_text=self.chunks.text(row),
+                score=float(score),
+                duplicate_sources=duplicate_sources.get(int(chunk_id), [])
+            )
+            sources.append(source)
         
         return sources
     
-    async def list_documents(self) -> List[Dict[str, Any]]:
-        """List all documents in the knowledge base."""
-        documents = {}
-        
-        for chunk_id, chunk in self.documents.items():
-            doc_id = chunk.metadata.get('document_id')
-            doc_name = chunk.metadata.get('document_name', 'Unknown')
-            
-            if doc_id not in documents:
-                documents[doc_id] = {
-                    'document_id': doc_id,
-                    'document_name': doc_name,
-                    'chunk_count': 0
-                }
-            
-            documents[doc_id]['chunk_count'] += 1
-        
-        return list(documents.values())
+    async def list_documents(self, cursor: Optional[str] = None, limit: int = 100) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """List one page of documents in the knowledge base and the cursor of the next page."""
+        return self.catalog.page(cursor, limit)
+    
+    async def list_chunks(self, cursor: Optional[str] = None, limit: int = 100) -> Tuple[List[DocumentChunk], Optional[str]]:
+        """List one page of chunks in insertion order and the cursor of the next page."""
+        rows, next_id = self.chunks.page(decode_cursor(cursor), limit)
+        return self.chunks.chunks(rows), str(next_id) if next_id is not None else None
     
     async def delete_document(self, doc_id: str) -> bool:
         """Delete a document and its chunks from the vector store."""
-        # Find chunks belonging to this document
-        chunks_to_remove = []
-        indices_to_remove = []
-        
-        for i, (chunk_key, chunk) in enumerate(self.documents.items()):
-            if chunk.metadata.get('document_id') == doc_id:
-                chunks_to_remove.append(chunk_key)
-                indices_to_remove.append(i)
-        
-        if not chunks_to_remove:
-            return False
-        
-        # Remove chunks from documents dict
-        for chunk_key in chunks_to_remove:
-            del self.documents[chunk_key]
-            if chunk_key in self.doc_metadata:
-                del self.doc_metadata[chunk_key]
-        
-        # Rebuild FAISS index (simple approach for MVP)
-        if self.documents:
-            texts = [chunk.text for chunk in self.documents.values()]
-            embeddings = self.model.encode(texts)
-            
-            # Create new index
-            self.index = faiss.IndexFlatL2(self.dimension)
-            self.index.add(embeddings.astype('float32'))
-        else:
-            # Empty index
-            self.index = faiss.IndexFlatL2(self.dimension)
-        
-        self._save_data()
+        async with self._mutation_lock:
+            if doc_id not in self.catalog:
+                return False
+            await self._log({'op': 'delete', 'doc_id': doc_id})
+            self._apply_delete(doc_id)
         return True
@@ -0,0 +1,273 @@
+import os
+import re
+import json
+import asyncio
+import logging
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_PATTERN = re.compile(r"^wal-(\d{8})\.log$")
+CURRENT_FILE = "CURRENT"
+
+def fsync_directory(directory: str):
+    """Make renames and new files in ``directory`` durable."""
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def atomic_write(path: str, data: bytes):
+    """Replace ``path`` with ``data`` via temp file + fsync + rename."""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+    fsync_directory(os.path.dirname(path) or ".")
+
+class WriteAheadLog:
+    """Append-only mutation log with group commit and snapshot compaction.
+
+    Mutations are appended as JSON lines to numbered segment files. Appends
+    that arrive within ``commit_interval_ms`` of each other share a single
+    write + fsync, so the persistence cost of a mutation does not depend on
+    the size of the store.
+
+    Compaction starts a new segment, then in a worker thread has the owner
+    build a snapshot for the new segment's generation from the previous
+    snapshot plus the segments before it (never from live state), atomically
+    points ``CURRENT`` at it and deletes older snapshots and segments. Recovery
+    loads the snapshot named by ``CURRENT`` and replays the segments from its
+    generation onwards; a torn record at the end of a segment (crash during
+    append) is truncated away. Records may be replayed on top of a snapshot
+    that already contains them, so owners must apply them idempotently.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        commit_interval_ms: Optional[float] = None,
+        compact_min_bytes: Optional[int] = None,
+    ):
+        self.directory = directory
+        if commit_interval_ms is None:
+            commit_interval_ms = float(os.getenv("WAL_COMMIT_INTERVAL_MS", "5"))
+        self.commit_interval = commit_interval_ms / 1000.0
+        self.compact_min_bytes = compact_min_bytes or int(os.getenv("WAL_COMPACT_MIN_BYTES", str(8 * 1024 * 1024)))
+        os.makedirs(directory, exist_ok=True)
+
+        self.snapshot_generation: Optional[int] = self._read_current()
+        self.snapshot_bytes = sum(
+            os.path.getsize(os.path.join(directory, entry)) for entry in os.listdir(directory)
+            if self.snapshot_generation is not None and entry.startswith(f"snapshot-{self.snapshot_generation:08d}-")
+        )
+        segments = self._segments()
+        self.generation = max(segments + [self.snapshot_generation or 0])
+        self.log_bytes = 0
+
+        self._file = None
+        self._pending: List[bytes] = []
+        self._waiters: List[asyncio.Future] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        self._compact_task: Optional[asyncio.Task] = None
+        self._write_lock = asyncio.Lock()
+
+    def _read_current(self) -> Optional[int]:
+        path = os.path.join(self.directory, CURRENT_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r') as f:
+            return json.load(f)["generation"]
+
+    def _segments(self) -> List[int]:
+        return sorted(
+            int(match.group(1)) for match in map(SEGMENT_PATTERN.match, os.listdir(self.directory)) if match
+        )
+
+    def _segment_path(self, generation: int) -> str:
+        return os.path.join(self.directory, f"wal-{generation:08d}.log")
+
+    def snapshot_path(self, name: str, generation: Optional[int] = None) -> str:
+        """Path of snapshot file ``name`` for a generation (default: the current snapshot)."""
+        generation = self.snapshot_generation if generation is None else generation
+        return os.path.join(self.directory, f"snapshot-{generation:08d}-{name}")
+
+    def _read_segment(self, path: str) -> Iterator[Tuple[bytes, Dict[str, Any]]]:
+        """Yield (line, record) for each intact record of a segment, stopping at a torn one."""
+        valid_bytes = 0
+        with open(path, 'rb') as f:
+            for line in f:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("incomplete record")
+                    record = json.loads(line)
+                except ValueError:
+                    logger.warning(f"Discarding torn record at byte {valid_bytes} of {path}")
+                    break
+                valid_bytes += len(line)
+                yield line, record
+
+    def replay(self) -> Iterator[Dict[str, Any]]:
+        """Yield the records logged after the current snapshot, in order."""
+        start = self.snapshot_generation or 0
+        for generation in self._segments():
+            if generation < start:
+                continue
+            path = self._segment_path(generation)
+            valid_bytes = 0
+            for line, record in self._read_segment(path):
+                valid_bytes += len(line)
+                self.log_bytes += len(line)
+                yield record
+            if valid_bytes < os.path.getsize(path):
+                os.truncate(path, valid_bytes)
+
+    def records(self, start: int, end: int) -> Iterator[Dict[str, Any]]:
+        """Yield the records of segments ``start <= generation < end`` without modifying them.
+
+        Safe to call from a worker thread while appends go to a later segment.
+        """
+        for generation in self._segments():
+            if start <= generation < end:
+                for _, record in self._read_segment(self._segment_path(generation)):
+                    yield record
+
+    def _open_segment(self):
+        self._file = open(self._segment_path(self.generation), 'ab')
+
+    def _write(self, lines: List[bytes]):
+        if self._file is None:
+            self._open_segment()
+        size = self._file.tell()
+        try:
+            self._file.write(b"".join(lines))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        except Exception:
+            self._discard_failed_write(size)
+            raise
+
+    def _discard_failed_write(self, size: int):
+        """Cut the segment back to ``size`` after a failed write.
+
+        Records acknowledged later must never follow torn bytes: replay
+        stops at the first torn record and would drop them. If the segment
+        cannot be cut back, later records go to a fresh segment instead.
+        """
+        path, file = self._segment_path(self.generation), self._file
+        self._file = None
+        try:
+            file.close()
+        except Exception:
+            pass  # Unflushed bytes are cut off below
+        try:
+            with open(path, 'r+b') as f:
+                f.truncate(size)
+                os.fsync(f.fileno())
+        except OSError as e:
+            logger.error(f"Could not truncate {path} after a failed write, starting a new segment: {e}")
+            self.generation += 1
+
+    async def append(self, record: Dict[str, Any]):
+        """Log ``record``; returns once it is durable on disk."""
+        line = (json.dumps(record, separators=(",", ":")) + "\n").encode('utf-8')
+        self.log_bytes += len(line)
+        waiter = asyncio.get_running_loop().create_future()
+        self._pending.append(line)
+        self._waiters.append(waiter)
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_soon())
+        await waiter
+
+    async def _flush_soon(self):
+        # Give concurrent appends a moment to join this group commit
+        await asyncio.sleep(self.commit_interval)
+        async with self._write_lock:
+            lines, waiters = self._pending, self._waiters
+            self._pending, self._waiters = [], []
+            self._flush_task = None
+            try:
+                await asyncio.to_thread(self._write, lines)
+            except Exception as e:
+                logger.error(f"WAL write failed: {e}")
+                self.log_bytes -= sum(len(line) for line in lines)
+                for waiter in waiters:
+                    if not waiter.done():
+                        waiter.set_exception(e)
+                return
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def needs_compaction(self) -> bool:
+        # Compacting only once the log outgrows the last snapshot keeps the
+        # amortised snapshot cost per logged byte constant
+        return self.log_bytes > max(self.compact_min_bytes, self.snapshot_bytes)
+
+    def maybe_compact(self, build_snapshot: Callable[[Optional[int], int], int]):
+        """Start a background compaction if the log has grown large enough.
+
+        ``build_snapshot(base_generation, generation)`` runs in a worker
+        thread. It must load the snapshot of ``base_generation`` (None if
+        there is none yet) into fresh state, apply ``records(base_generation
+        or 0, generation)``, write the result as snapshot files for
+        ``generation`` (via ``snapshot_path``) and return the bytes written.
+        It must not touch the owner's live state, so compaction costs the
+        event loop nothing however large the store is.
+        """
+        if self._compact_task is None and self.needs_compaction():
+            self._compact_task = asyncio.create_task(self._compact(build_snapshot))
+
+    async def _compact(self, build_snapshot: Callable[[Optional[int], int], int]):
+        try:
+            async with self._write_lock:
+                # Everything logged from here on goes to the new segment, so
+                # the earlier segments are complete and no longer change
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+                self.generation += 1
+                self.log_bytes = sum(len(line) for line in self._pending)
+            base_generation, generation = self.snapshot_generation, self.generation
+            self.snapshot_bytes = await asyncio.to_thread(
+                self._publish_snapshot, lambda target: build_snapshot(base_generation, target), generation
+            )
+            logger.info(f"Compacted WAL in {self.directory} into snapshot {generation}")
+        except Exception as e:
+            logger.error(f"WAL compaction failed: {e}")
+        finally:
+            self._compact_task = None
+
+    def _publish_snapshot(self, write_snapshot: Callable[[int], int], generation: int) -> int:
+        snapshot_bytes = write_snapshot(generation)
+        fsync_directory(self.directory)
+        atomic_write(
+            os.path.join(self.directory, CURRENT_FILE),
+            json.dumps({"generation": generation}).encode('utf-8')
+        )
+        previous = self.snapshot_generation
+        self.snapshot_generation = generation
+
+        # The new snapshot is live; older snapshots and segments are garbage
+        for entry in os.listdir(self.directory):
+            match = SEGMENT_PATTERN.match(entry)
+            stale_segment = match and int(match.group(1)) < generation
+            stale_snapshot = entry.startswith("snapshot-") and not entry.startswith(f"snapshot-{generation:08d}-")
+            if stale_segment or stale_snapshot:
+                os.remove(os.path.join(self.directory, entry))
+        if previous is not None:
+            logger.info(f"Removed snapshot {previous} and its log segments")
+        return snapshot_bytes
+
+    async def close(self):
+        """Flush pending records and wait for a running compaction to finish."""
+        if self._flush_task is not None:
+            await self._flush_task
+        if self._compact_task is not None:
+            await self._compact_task
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,58 @@
+"""Simulations of the admission limit under LLM-like latencies, on a fake clock.
+
+Run from ``backend/`` with ``python -m pytest``.
+"""
+import math
+import random
+import asyncio
+
+import services.admission_controller as admission_controller
+from services.admission_controller import AdmissionController
+
+class FakeClock:
+    """Stands in for the ``time`` module, so simulated hours take milliseconds."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+def simulate(monkeypatch, first_response_times, answer_seconds: float = 0.5) -> AdmissionController:
+    """Run one request per time to first response, one after the other."""
+    clock = FakeClock()
+    monkeypatch.setattr(admission_controller, "time", clock)
+    controller = AdmissionController(initial_limit=16, baseline_window=300)
+
+    async def run():
+        for first_response in first_response_times:
+            async with controller.admit() as admission:
+                clock.now += first_response
+                admission.responding()
+                clock.now += answer_seconds
+
+    asyncio.run(run())
+    return controller
+
+def lognormal(rng: random.Random, median: float, sigma: float = 1.0) -> float:
+    return median * math.exp(rng.gauss(0.0, sigma))
+
+def test_latency_spread_does_not_cut_limit(monkeypatch):
+    # Steady load whose time to first token varies several-fold from request
+    # to request, as LLM latencies do: no sign of overload
+    rng = random.Random(7)
+    controller = simulate(monkeypatch, [lognormal(rng, 0.5) for _ in range(5000)])
+    assert controller.limit == 16
+
+def test_short_latency_spike_does_not_cut_limit(monkeypatch):
+    rng = random.Random(7)
+    times = [lognormal(rng, 0.5) for _ in range(500)] + [5.0] * 10 + [lognormal(rng, 0.5) for _ in range(500)]
+    controller = simulate(monkeypatch, times)
+    assert controller.limit == 16
+
+def test_sustained_latency_rise_cuts_limit(monkeypatch):
+    # Upstream queueing triples the time to first token from request 500 on
+    rng = random.Random(7)
+    times = [lognormal(rng, 0.5) for _ in range(500)] + [lognormal(rng, 1.5) for _ in range(100)]
+    controller = simulate(monkeypatch, times)
+    assert controller.limit < 16
@@ -22,12 +22,22 @@ const AppContent: React.FC = () => {
   const fetchDocuments = useCallback(async () => {
     setIsLoading(true);
     try {
-      const response = await fetch(`${API_BASE_URL}/documents`);
-      if (!response.ok) {
-        throw new Error(`HTTP ${response.status}: ${response.statusText}`);
-      }
-      const data = await response.json();
-      setDocuments(data.documents || []);
+      // The API returns documents a page at a time; follow next_cursor to the end
+      const allDocuments: Document[] = [];
+      let cursor: string | null = null;
+      do {
+        const url: string = cursor
+          ? `${API_BASE_URL}/documents?limit=1000&cursor=${encodeURIComponent(cursor)}`
+          : `${API_BASE_URL}/documents?limit=1000`;
+        const response = await fetch(url);
+        if (!response.ok) {
+          throw new Error(`HTTP ${response.status}: ${response.statusText}`);
+        }
+        const data = await response.json();
+        allDocuments.push(...(data.documents || []));
+        cursor = data.next_cursor ?? null;
+      } while (cursor);
+      setDocuments(allDocuments);
     } catch (error) {
       console.error('Error fetching documents:', error);
       addNotification({
@@ -38,6 +38,8 @@ const ChatInterface: React.FC<ChatInterfaceProps> = ({ documents }) => {
   const [messages, setMessages] = useState<Message[]>([]);
   const [inputMessage, setInputMessage] = useState('');
   const [isLoading, setIsLoading] = useState(false);
+  // Returned by the first /chat call; sent back so the server keeps the history
+  const [conversationId, setConversationId] = useState<string | null>(null);
   const messagesEndRef = useRef<HTMLDivElement>(null);
 
   const scrollToBottom = () => {
@@ -73,6 +75,7 @@ const ChatInterface: React.FC<ChatInterfaceProps> = ({ documents }) => {
         },
         body: JSON.stringify({
           message: inputMessage,
+          ...(conversationId ? { conversation_id: conversationId } : {}),
         }),
       });
 
@@ -81,6 +84,9 @@ const ChatInterface: React.FC<ChatInterfaceProps> = ({ documents }) => {
       }
 
       const data = await response.json();
+      if (data.conversation_id) {
+        setConversationId(data.conversation_id);
+      }
 
       const botMessage: Message = {
         id: (Date.now() + 1).toString(),